@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+import threading
+
+from prometheus_client import Counter, Gauge
+
+from pool import SolverOverloaded, SolverTooLarge
+from solver.solver import Preferences, get_backend
+
+admissions_total = Counter('admissions_total', 'Solves through admission control, by outcome', ['outcome'])
+admitted_load = Gauge('admitted_load_seconds', 'Estimated CPU seconds of the solves in progress',
+                      multiprocess_mode='livesum')
+
+
+def problem_size(problem):
+    """
+    :param problem: A problem that has passed pre-validation.
+    :return: N, M and the sum of T.
+    """
+    demands = problem["demands"]
+    if isinstance(demands, Preferences):
+        paints = len(demands.paint_colors)
+    else:
+        paints = sum((len(customer) - 1) // 2 for customer in demands)
+    return problem["colors"], problem["customers"], paints
+
+
+class Admission:
+    """
+    Decides which solves to start, from the engine's estimate of what each
+    will cost, made before any work is done.
+
+    A solve estimated to need more memory than a request may use is refused
+    outright. Otherwise it is admitted if the estimated CPU seconds of the
+    solves already in progress leave room for it. If they don't, it waits
+    for room for a while and is then refused, as the service is overloaded.
+    Cheap solves fit in the room that expensive ones can't, so a burst of
+    large problems doesn't hold up small ones. With nothing in progress any
+    solve is admitted, however expensive, leaving the CPU budget to bound it.
+    """
+
+    def __init__(self, capacity=None, wait=1.0, cpu_budget=None, max_memory=None):
+        """
+        :param capacity: The estimated CPU seconds of solves that may be in
+                         progress at once, or None for no limit.
+        :param wait: The most seconds a solve waits for room.
+        :param cpu_budget: The seconds of CPU time a solve may use, or None.
+        :param max_memory: The bytes of memory a solve may need, or None.
+        """
+        self.capacity = capacity
+        self.wait = wait
+        self.cpu_budget = cpu_budget
+        self.max_memory = max_memory
+        self.load = 0.0
+        self.running = 0
+        self._room = threading.Condition()
+
+    def estimate(self, problem, engine):
+        """
+        :param problem: A problem that has passed pre-validation.
+        :param engine: The engine that will solve it.
+        :return: The estimated CPU seconds the solve will use, at most the
+                 CPU budget. Raises SolverTooLarge for a solve that may not
+                 be started at all.
+        """
+        seconds, memory = get_backend(engine).estimate(*problem_size(problem))
+        if self.max_memory is not None and memory > self.max_memory:
+            admissions_total.labels('too_large').inc()
+            raise SolverTooLarge("Solve would need about %d bytes" % memory)
+        if self.cpu_budget is not None:
+            seconds = min(seconds, self.cpu_budget)
+        return seconds
+
+    def admit(self, problem, engine):
+        """
+        Wait until a solve may start.
+
+        :param problem: A problem that has passed pre-validation.
+        :param engine: The engine that will solve it.
+        :return: The solve's estimated cost, to pass to release() once it
+                 has finished.
+        """
+        seconds = self.estimate(problem, engine)
+
+        outcome = 'admitted'
+        give_up = time.time() + self.wait
+        with self._room:
+            while self.capacity is not None and self.running and self.load + seconds > self.capacity:
+                remaining = give_up - time.time()
+                if remaining <= 0:
+                    admissions_total.labels('overloaded').inc()
+                    raise SolverOverloaded("No room for a solve estimated at %.3f seconds" % seconds)
+                outcome = 'queued'
+                self._room.wait(remaining)
+            self.load += seconds
+            self.running += 1
+        admitted_load.inc(seconds)
+        admissions_total.labels(outcome).inc()
+        return seconds
+
+    def release(self, seconds):
+        with self._room:
+            self.running -= 1
+            # Don't let rounding errors build up.
+            self.load = self.load - seconds if self.running else 0.0
+            self._room.notify_all()
+        admitted_load.dec(seconds)
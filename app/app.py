@@ -6,57 +6,339 @@ from __future__ import unicode_literals
 import sys
 import argparse
 import random
+from contextlib import contextmanager
 
-from solver.solver import solver
-from flask import Flask, request
+from admission import Admission
+from cache import ResultCache
+from jobs import CANCELLED, DEFAULT_DEADLINE, DONE, QUEUED, RUNNING, JobQueue
+from metrics import record_solve, rejections_total, stage_seconds
+from pool import SolverError, SolverOverloaded, SolverPool
+from profiling import Profiler
+from sessions import Sessions
+from store import SolutionStore
+from solver.prevalidate import NOT_JSON
+from solver.session import Session
+from solver.bulk import bulk_solve
+# The class the solver itself checks packed requests against.
+from solver.solver import BACKENDS, Preferences, explain
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 import json
 from prometheus_client import Counter, start_wsgi_server as prometheus_server
 
 
 
 MAX_VALUE = 1000
+# Far more than any problem within the limits takes, however it is laid out.
+MAX_PROBLEM_BYTES = 1 << 20
 
 app = Flask(__name__)
 app.config.from_object(__name__)
+app.config.update({'pool': SolverPool(observer=record_solve), 'profiler': None, 'stateful': True,
+                   'sessions': Sessions()})
+app.config.update({'jobs': JobQueue(app.config['pool'])})
 requests_total = Counter('requests_total', 'Total number of requests')
 
+# Sessions live in the serving process that created them, as do background
+# jobs, so both are turned off (--stateless) when requests are spread over
+# several processes.
+
+
+@app.before_request
+def stateless():
+    if not app.config['stateful'] and request.path.startswith(('/v2/sessions', '/v2/jobs')):
+        abort(501, "Sessions and background jobs are turned off in this server")
+
 
 # The root endpoint returns the app value. Some percentage of the time
 # (given by app.config['failure_rate']) calls to this endpoint will cause the
 # app to crash (exits non-zero).
-@app.route('/v1/')
+#
+# Problems can also be POSTed, either as a JSON body or packed as
+# little-endian int32 arrays (Content-Type: application/octet-stream), which
+# are handed to the solver without being copied or turned into lists.
+#
+# A problem that isn't JSON is refused with 400 and counted as a not_json
+# rejection, and a body over MAX_PROBLEM_BYTES is refused with 413 unread.
+#
+# A request can pick the solver engine with ?engine= (see solver.backends).
+# With ?explain=1 the answer is a JSON object saying, for an impossible
+# problem, which customers conflict (see solver.explain).
+#
+# A problem estimated to need more memory than a solve may use is answered
+# TOO_LARGE (413), and one that can't be admitted while the server is busy
+# OVERLOADED (503, with Retry-After); see admission.Admission.
+#
+# When the app is started with --profile-dir, a request with ?profile=1 or an
+# X-Profile header (or one picked at --profile-rate) is solved in the serving
+# thread under the profiler, subject to the pool's cache, admission and
+# limits, and its capture id is returned in the X-Profile-Id header. One solve
+# is profiled at a time: a request asking for another meanwhile is answered
+# PROFILER_BUSY (409). See profiling.Profiler.
+@app.route('/v1/', methods=['GET', 'POST'])
 def index():
-    input_val = json.loads(request.args.get("input"))
-    result = solver(input_val)
+    requests_total.inc()
+    input_val = parse_problem()
+    if request.args.get('explain'):
+        # Explanations are cheap to work out but aren't cached, so are made here.
+        return jsonify(explain(input_val))
+    pool = app.config['pool']
+    profiler = app.config['profiler']
+    try:
+        requested = bool(request.args.get('profile') or request.headers.get('X-Profile'))
+        if profiler is not None and isinstance(input_val, dict) and (requested or profiler.sample()):
+            result, capture_id = profiler.solve(input_val, request_engine() or pool.engine, pool, requested)
+            return result, 200, {'X-Profile-Id': capture_id} if capture_id else {}
+        result = pool.solve(input_val, request_engine())
+    except SolverOverloaded as e:
+        return e.code, e.status, {'Retry-After': '1'}
+    except SolverError as e:
+        return e.code, e.status
     return result
 
 
+def decode_line(line):
+    # A line that isn't JSON is answered IMPOSSIBLE, like any other bad
+    # problem, rather than cutting short a response already being streamed.
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def parse_problem():
+    if request.method == 'POST' and request.mimetype == 'application/octet-stream':
+        with stage_seconds.labels('parse_packed').time():
+            try:
+                prefs = Preferences.from_bytes(read_body())
+            except ValueError as e:
+                abort(400, str(e))
+            return {"colors": prefs.colors, "customers": prefs.customers, "demands": prefs}
+    with stage_seconds.labels('parse_json').time():
+        try:
+            if request.method == 'POST':
+                return json.loads(read_body().decode('utf-8'))
+            return json.loads(request.args.get("input"))
+        except (ValueError, TypeError):
+            rejections_total.labels(NOT_JSON).inc()
+            abort(400, "The problem is not JSON")
+
+
+def read_body():
+    if request.content_length is not None and request.content_length > MAX_PROBLEM_BYTES:
+        abort(413, "A problem may be at most %d bytes" % MAX_PROBLEM_BYTES)
+    return request.get_data()
+
+
+def request_engine():
+    # The solver engine asked for with ?engine=, if any.
+    engine = request.args.get('engine')
+    if engine is not None and engine not in BACKENDS:
+        abort(400, "Unknown solver engine: %s" % engine)
+    return engine
+
+
+# Solve many problems in one call. The body is either a JSON array of
+# problems or newline-delimited JSON (one problem per line), and results are
+# streamed back in order, one "Case #n: ..." line per problem. A line that
+# isn't JSON is answered IMPOSSIBLE, but an array body that isn't is refused
+# with 400, as nothing in it can be told apart.
+#
+# With ?bulk=1 the problems are instead solved all together in this process
+# (see solver.bulk), which is much quicker for many small problems but
+# skips the worker pool and the cache.
+@app.route('/v2/batch', methods=['POST'])
+def batch():
+    requests_total.inc()
+    engine = request_engine()
+    if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+        problems = (decode_line(line) for line in request.stream if line.strip())
+    else:
+        with stage_seconds.labels('parse_json').time():
+            try:
+                problems = json.loads(request.get_data(as_text=True))
+            except ValueError:
+                abort(400, "The body is neither a JSON array of problems nor one problem per line")
+        if isinstance(problems, dict):
+            problems = [problems]
+        if not isinstance(problems, list):
+            abort(400, "The body is not a JSON array of problems")
+
+    if request.args.get('bulk'):
+        if engine not in (None, 'greedy'):
+            abort(400, "Bulk solves use the greedy engine")
+        with stage_seconds.labels('bulk_solve').time():
+            results = bulk_solve(list(problems))
+    else:
+        results = app.config['pool'].map(problems, engine)
+
+    def generate():
+        for i, result in enumerate(results):
+            yield "Case #{}: {}\n".format(i + 1, result)
+
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+
+# Jobs solve a problem in the background. Submitting one (as for /v1/)
+# returns its id straight away; its status, including how many iterations
+# the search has done, can then be polled until the result is ready, or the
+# job cancelled. A problem too large to solve is refused as it is by /v1/.
+@app.route('/v2/jobs', methods=['POST'])
+def submit_job():
+    requests_total.inc()
+    try:
+        job = app.config['jobs'].submit(parse_problem(), request_engine())
+    except SolverError as e:
+        return e.code, e.status
+    return jsonify(job.status()), 202, {'Location': '/v2/jobs/%s' % job.id}
+
+
+@app.route('/v2/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    return jsonify(find_job(job_id).status())
+
+
+@app.route('/v2/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = find_job(job_id)
+    if job.state in (QUEUED, RUNNING):
+        return jsonify(job.status()), 202
+    if job.state == CANCELLED:
+        return "CANCELLED", 409
+    if job.state != DONE:
+        # Out of time or failed, answered as /v1/ would be.
+        return job.result, 503
+    return job.result
+
+
+@app.route('/v2/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    find_job(job_id)
+    return jsonify(app.config['jobs'].cancel(job_id).status())
+
+
+def find_job(job_id):
+    job = app.config['jobs'].get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+# Sessions hold a problem that is edited a customer at a time, updating the
+# solution incrementally rather than re-solving from scratch. They are kept
+# while in use, up to --session-limit of them, and a session idle for
+# --session-ttl seconds is gone (404).
+@app.route('/v2/sessions', methods=['POST'])
+def create_session():
+    problem = request.get_json(force=True)
+    with session_errors():
+        session = Session.from_problem(problem)
+    session_id = app.config['sessions'].add(session)
+    return jsonify({'id': session_id, 'customers': sorted(session.custs)}), 201
+
+
+@app.route('/v2/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    lock, session = find_session(session_id)
+    with lock:
+        return session.solution()
+
+
+@app.route('/v2/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    find_session(session_id)
+    app.config['sessions'].pop(session_id)
+    return '', 204
+
+
+@app.route('/v2/sessions/<session_id>/customers', methods=['POST'])
+def add_customer(session_id):
+    lock, session = find_session(session_id)
+    customer = request.get_json(force=True)
+    with lock, session_errors():
+        customer_id = session.add_customer(customer)
+    return jsonify({'id': customer_id}), 201
+
+
+@app.route('/v2/sessions/<session_id>/customers/<int:customer_id>', methods=['DELETE'])
+def remove_customer(session_id, customer_id):
+    lock, session = find_session(session_id)
+    with lock, session_errors():
+        session.remove_customer(customer_id)
+    return '', 204
+
+
+@app.route('/v2/sessions/<session_id>/colors', methods=['PUT'])
+def set_colors(session_id):
+    lock, session = find_session(session_id)
+    body = request.get_json(force=True)
+    with lock, session_errors():
+        session.set_colors(body.get('colors') if isinstance(body, dict) else body)
+    return '', 204
+
+
+def find_session(session_id):
+    found = app.config['sessions'].get(session_id)
+    if found is None:
+        abort(404)
+    return found
+
+
+@contextmanager
+def session_errors():
+    # Refused edits are the client's fault.
+    try:
+        yield
+    except (ValueError, TypeError, AttributeError) as e:
+        abort(400, str(e))
+
+
 # To help with testing this endpoint will cause the app to crash
 # every time it is called
 @app.route('/crash')
 def crash():
     requests_total.inc()
-    request.environ.get('werkzeug.server.shutdown')()
+    # Under serve.py this gracefully reloads the workers instead.
+    shutdown = app.config.get('shutdown') or request.environ.get('werkzeug.server.shutdown')
+    shutdown()
     app.config.update({'crashed': True})
     return "{}"
 
 
 def main(args):
     prometheus_server(args.monitor)
+    configure(args)
+    app.run('0.0.0.0', port=args.port, threaded=True)
+    app.config['pool'].close()
 
+    if app.config['crashed']:
+        print('app crashed, exiting non-zero')
+        sys.exit(1)
+
+
+def configure(args):
+    admission = Admission(args.max_load, args.admission_wait, args.cpu_budget,
+                          args.max_memory * 2 ** 20 if args.max_memory else None)
+    pool = SolverPool(args.workers, args.job_timeout,
+                      ResultCache(args.cache_size, args.cache_ttl, args.cache_dir, args.cache_dir_size),
+                      record_solve, args.engine, admission,
+                      SolutionStore(args.store_dir) if args.store_dir else None)
     app.config.update({
         'input': args.input,
         'failure_rate': args.failure_rate,
-        'crashed': False
+        'crashed': False,
+        'stateful': not args.stateless,
+        'pool': pool,
+        'jobs': JobQueue(pool, args.background_workers, args.background_deadline),
+        'sessions': Sessions(args.session_limit, args.session_ttl),
+        'profiler': Profiler(args.profile_dir, args.profile_rate, args.profile_retain) if args.profile_dir else None
     })
-    app.run('0.0.0.0', port=args.port)
-
-    if app.config['crashed']:
-        print('app crashed, exiting non-zero')
-        sys.exit(1)
 
 
 def parse_args():
+    return build_parser().parse_args()
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '--input',
@@ -76,13 +358,133 @@ def parse_args():
         required=True,
         help='the monitoring port'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='the number of solver worker processes (0 solves in the serving thread)'
+    )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='greedy',
+        choices=sorted(BACKENDS),
+        help='the solver engine used unless a request asks for another'
+    )
+    parser.add_argument(
+        '--job-timeout',
+        type=float,
+        default=None,
+        help='the maximum number of seconds a solve may take on a worker'
+    )
+    parser.add_argument(
+        '--cpu-budget',
+        type=float,
+        default=None,
+        help='the maximum number of seconds of CPU time a solve may use'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=int,
+        default=None,
+        help='the maximum number of megabytes a solve is estimated to need before it is refused'
+    )
+    parser.add_argument(
+        '--max-load',
+        type=float,
+        default=None,
+        help='the estimated CPU seconds of solves that may be in progress at once'
+    )
+    parser.add_argument(
+        '--admission-wait',
+        type=float,
+        default=1.0,
+        help='the number of seconds a solve waits to be admitted before the request is refused'
+    )
+    parser.add_argument(
+        '--background-workers',
+        type=int,
+        default=1,
+        help='the number of threads solving jobs submitted to /v2/jobs'
+    )
+    parser.add_argument(
+        '--background-deadline',
+        type=float,
+        default=DEFAULT_DEADLINE,
+        help='the maximum number of seconds a job submitted to /v2/jobs may take, counted from submission'
+    )
+    parser.add_argument(
+        '--session-limit',
+        type=int,
+        default=1024,
+        help='the number of sessions kept, the least recently used being dropped first'
+    )
+    parser.add_argument(
+        '--session-ttl',
+        type=float,
+        default=3600,
+        help='the number of seconds a session may go unused before it is dropped'
+    )
+    parser.add_argument(
+        '--stateless',
+        action='store_true',
+        help='turn off /v2/sessions and /v2/jobs, whose state is held by the process that created it'
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=1024,
+        help='the number of results held in memory (0 disables the in-memory cache)'
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=3600,
+        help='the number of seconds a result is held in memory or in --cache-dir'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help='a directory in which to keep results across restarts'
+    )
+    parser.add_argument(
+        '--cache-dir-size',
+        type=int,
+        default=100000,
+        help='the number of results kept in --cache-dir, the oldest being removed first'
+    )
+    parser.add_argument(
+        '--store-dir',
+        type=str,
+        default=None,
+        help='a directory in which every solution is kept for good'
+    )
+    parser.add_argument(
+        '--profile-dir',
+        type=str,
+        default=None,
+        help='a directory in which to keep profiles of requested solves (enables profiling)'
+    )
+    parser.add_argument(
+        '--profile-rate',
+        type=float,
+        default=0.0,
+        help='the fraction of requests profiled without being asked'
+    )
+    parser.add_argument(
+        '--profile-retain',
+        type=int,
+        default=100,
+        help='the number of profiles kept'
+    )
     parser.add_argument(
         '--failure-rate',
         type=float,
         default=0.2,
         help='the failure rate'
     )
-    return parser.parse_args()
+    return parser
 
 
 if __name__ == '__main__':
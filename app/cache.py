@@ -0,0 +1,250 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows); solves aren't coordinated between processes.
+    fcntl = None
+
+from prometheus_client import Counter
+
+cache_hits = Counter('cache_hits_total', 'Result cache hits', ['tier'])
+cache_misses = Counter('cache_misses_total', 'Result cache misses')
+
+# Writes to the cache directory between prunings of it.
+PRUNE_EVERY = 1000
+
+
+def normalise_demands(demands):
+    """
+    Put demands in a canonical order: the pairs within each customer are
+    sorted, and then the customers themselves are sorted. Neither order
+    affects the answer. Demands that aren't well formed are left untouched.
+
+    :param demands: A list of [T, X, Y, X, Y, ...] customer arrays, or
+                    Preferences decoded from a packed request.
+    :return: The demands in canonical order.
+    """
+    if hasattr(demands, 'to_demands'):
+        if not demands.is_well_formed():
+            return ["packed", demands.to_bytes().hex()]
+        demands = demands.to_demands()
+    if not isinstance(demands, list):
+        return demands
+    customers = []
+    for customer in demands:
+        if not isinstance(customer, list) or len(customer) % 2 != 1 or \
+                not all(isinstance(i, int) and not isinstance(i, bool) for i in customer):
+            return demands
+        pairs = sorted(zip(customer[1::2], customer[::2][1:]))
+        customers.append([customer[0]] + [i for pair in pairs for i in pair])
+    return sorted(customers)
+
+
+def canonical_problem(problem):
+    """
+    :param problem: A {colors, customers, demands} problem.
+    :return: The problem as JSON in which the order of its customers, and of
+             the paints within a customer, is canonical.
+    """
+    if isinstance(problem, dict):
+        canonical = [problem.get("colors"), problem.get("customers"),
+                     normalise_demands(problem.get("demands"))]
+    else:
+        canonical = problem
+    return json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+
+
+def problem_key(problem):
+    """
+    Hash a problem so that requests which differ only in the order of their
+    customers, or of the paints within a customer, share a key.
+
+    :param problem: A {colors, customers, demands} problem.
+    :return: A hex digest.
+    """
+    return hashlib.sha256(canonical_problem(problem).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Solver results keyed by problem_key. An in-process LRU bounded by entry
+    count and age sits in front of an optional directory of one file per
+    result, which survives restarts and is shared by every process using it.
+
+    Results on disk age from when they were written, and expire after the
+    same `ttl`. Every PRUNE_EVERY writes the directory is pruned of expired
+    results, and then of the oldest until at most `disk_maxsize` are left.
+    """
+
+    key = staticmethod(problem_key)
+
+    def __init__(self, maxsize=1024, ttl=3600, directory=None, disk_maxsize=100000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_maxsize = disk_maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    cache_hits.labels('memory').inc()
+                    return result
+                del self._entries[key]
+
+        result, written = self._read(key)
+        if result is not None:
+            cache_hits.labels('disk').inc()
+            self._remember(key, result, written)
+            return result
+
+        cache_misses.inc()
+        return None
+
+    def put(self, key, result):
+        self._remember(key, result)
+        self._write(key, result)
+
+    def claim(self, key):
+        """
+        Take the lock on solving a problem, shared by every process using the
+        cache directory. While another process holds it, this blocks until
+        that process has put its result (or given up), so the caller should
+        look in the cache again before solving. The lock is dropped by the
+        system if its holder dies, and its file is removed on release.
+
+        :param key: The problem's key.
+        :return: The lock, to pass to release(), or None with no directory.
+        """
+        if self.directory is None or fcntl is None:
+            return None
+        path = self._path(key) + ".lock"
+        while True:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                lock = open(path, 'a')
+            except (IOError, OSError):
+                return None
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # The holder may have removed the file while we waited, in which
+            # case a newcomer could lock a new one; lock that instead.
+            try:
+                if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                    return lock
+            except OSError:
+                pass
+            lock.close()
+
+    def release(self, lock):
+        if lock is None:
+            return
+        # Removed while still held: anyone waiting on it then finds it gone
+        # and locks a new one.
+        try:
+            os.remove(lock.name)
+        except OSError:
+            pass
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def prune(self):
+        """
+        Remove expired results from the cache directory, and then the
+        oldest until no more than disk_maxsize are left.
+
+        :return: The number of results removed.
+        """
+        if self.directory is None:
+            return 0
+        results = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                # Skip lock files and results still being written.
+                if name.endswith((".lock", ".tmp")):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    results.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        results.sort()
+        expired = time.time() - self.ttl if self.ttl else None
+        removed = 0
+        for i, (written, path) in enumerate(results):
+            if len(results) - i <= self.disk_maxsize and (expired is None or written > expired):
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Already removed by another process.
+                pass
+        return removed
+
+    def _remember(self, key, result, written=None):
+        if self.maxsize <= 0:
+            return
+        expires = (written or time.time()) + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (result, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read(self, key):
+        # The result and when it was written, or None and None.
+        if self.directory is None:
+            return None, None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                written = os.fstat(f.fileno()).st_mtime
+                result = f.read()
+        except (IOError, OSError):
+            return None, None
+        if self.ttl and written + self.ttl <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+        return result, written
+
+    def _write(self, key, result):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                f.write(result)
+            # Readers only ever see complete results.
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
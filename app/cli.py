@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#usage: ./cli.py [--workers 4] [input.txt | -] > output.txt
+"""
+Solve Code Jam style input files without going through the HTTP service.
+Cases are read, solved and written one at a time, so memory use doesn't
+grow with the size of the input.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import sys
+import argparse
+from itertools import islice
+
+from pool import SolverPool
+from solver.bulk import bulk_solve
+from solver.solver import BACKENDS
+
+
+def read_cases(lines):
+    """
+    Lazily parse the Code Jam style input format: the number of cases, then
+    for each case N, M and one "T X Y X Y ..." line per customer.
+
+    :param lines: An iterable of lines, e.g. an open file.
+    :return: A generator of {colors, customers, demands} problems. Raises
+             ValueError, once the cases before it are read, at a line that
+             isn't a number where one is expected or at the end of an input
+             cut short.
+    """
+    lines = (line.strip() for line in lines)
+    lines = (line for line in lines if line)
+    testcases = int(next(lines, 0))
+    for case in range(1, testcases + 1):
+        counts = [int(line) for line in islice(lines, 2)]
+        if len(counts) < 2:
+            raise ValueError("case %d: expected N and M, but the input ended" % case)
+        colors, customers = counts
+        demands = [list(map(int, line.split())) for line in islice(lines, customers)]
+        if len(demands) < customers:
+            raise ValueError("case %d: expected %d customers, but the input ended after %d" % (
+                case, customers, len(demands)))
+        yield {"colors": colors, "customers": customers, "demands": demands}
+
+
+def bulk_results(problems, size):
+    # Solve the problems together, a chunk of them at a time.
+    while True:
+        chunk = list(islice(problems, size))
+        if not chunk:
+            return
+        for result in bulk_solve(chunk):
+            yield result
+
+
+def main(args):
+    pool = SolverPool(args.workers, args.job_timeout, engine=args.engine)
+    stream = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        if args.bulk:
+            results = bulk_results(read_cases(stream), args.bulk)
+        else:
+            results = pool.map(read_cases(stream))
+        for i, result in enumerate(results):
+            sys.stdout.write("Case #{}: {}\n".format(i + 1, result))
+    except ValueError as e:
+        sys.stdout.flush()
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        pool.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'input',
+        type=str,
+        nargs='?',
+        default='-',
+        help='the input file (- for stdin)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help='the number of solver worker processes (0 solves in this process)'
+    )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='greedy',
+        choices=sorted(BACKENDS),
+        help='the solver engine'
+    )
+    parser.add_argument(
+        '--bulk',
+        type=int,
+        default=0,
+        help='solve this many cases at a time together, with the greedy engine (0 solves them one by one)'
+    )
+    parser.add_argument(
+        '--job-timeout',
+        type=float,
+        default=None,
+        help='the maximum number of seconds a solve may take on a worker'
+    )
+    args = parser.parse_args(argv)
+    if args.bulk and args.engine != 'greedy':
+        parser.error("--bulk solves with the greedy engine only")
+    return args
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+import uuid
+import threading
+from collections import deque
+
+from six.moves import queue
+from prometheus_client import Counter, Gauge
+
+from pool import SolverOverloaded
+from solver.control import Cancelled, Control, DeadlineExceeded, thread_time
+from solver.solver import solver
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+FAILED = "failed"
+
+# The seconds a job may take, queued or running, unless the queue is given a limit.
+DEFAULT_DEADLINE = 600
+
+jobs_total = Counter('jobs_total', 'Background jobs finished', ['state'])
+jobs_active = Gauge('jobs_active', 'Background jobs waiting or running', ['state'],
+                    multiprocess_mode='livesum')
+job_iterations = Counter('jobs_iterations_total', 'Search iterations done by background jobs')
+
+
+class JobControl(Control):
+    # Counts the iterations of a job as its search reports them.
+
+    def __init__(self, deadline=None):
+        Control.__init__(self, deadline)
+        self.counted = 0
+
+    def check(self, iterations, best_fitness=None):
+        self.count(iterations)
+        Control.check(self, iterations, best_fitness)
+
+    def start(self, cpu_budget=None):
+        # The CPU budget is measured from the start of the solve, on the thread running it.
+        self.cpu_limit = thread_time() + cpu_budget if cpu_budget else None
+
+    def count(self, iterations):
+        job_iterations.inc(max(0, iterations - self.counted))
+        self.counted = max(iterations, self.counted)
+
+
+class BackgroundJob:
+
+    def __init__(self, problem, engine, deadline=None):
+        self.id = uuid.uuid4().hex
+        self.problem = problem
+        self.engine = engine
+        self.control = JobControl(deadline)
+        self.state = QUEUED
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def status(self):
+        """
+        :return: A dict describing the job and how far its search has got.
+        """
+        end = self.finished or time.time()
+        return {
+            'id': self.id,
+            'state': self.state,
+            'iterations': self.control.iterations,
+            'best_fitness': self.control.best_fitness,
+            'queued_seconds': (self.started or end) - self.submitted,
+            'running_seconds': end - self.started if self.started else 0,
+        }
+
+
+class JobQueue:
+    """
+    Solves problems on background threads, so that a client submits a
+    problem, polls its status and fetches the result later instead of
+    holding a connection open for the whole solve.
+
+    Solves are run in this process, where the search can be followed and
+    stopped: a running job checks for cancellation and for its deadline
+    between iterations. Problems the pool can answer without solving
+    (rejected or cached ones) finish straight away, and results are recorded
+    by the pool. Finished jobs are kept until there are more than
+    `retain` of them, oldest first.
+
+    Jobs are held to the pool's limits: a problem its Admission would refuse
+    as too large is refused when submitted, and a job waits to be admitted
+    before solving (for as long as its deadline allows, rather than being
+    refused when the server is busy) and is stopped at the CPU budget.
+
+    The worker threads are started by the first job that needs one, so a
+    queue made before the server forks (or never used) starts none.
+    """
+
+    def __init__(self, pool, workers=1, deadline=DEFAULT_DEADLINE, retain=1024):
+        self.pool = pool
+        self.workers = workers
+        self.deadline = deadline
+        self.retain = retain
+        self._jobs = {}
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def submit(self, problem, engine=None):
+        """
+        :param problem: A {colors, customers, demands} problem.
+        :param engine: The engine to use, if not the pool's.
+        :return: The BackgroundJob.
+        """
+        engine = engine or self.pool.engine
+        key, result, stats = self.pool.lookup(problem)
+        if result is None and self.pool.admission is not None:
+            # Raises SolverTooLarge for a problem that may never be solved.
+            self.pool.admission.estimate(problem, engine)
+
+        job = BackgroundJob(problem, engine, self.deadline)
+        with self._lock:
+            self._jobs[job.id] = job
+        if result is not None:
+            self._finish(job, DONE, result, stats)
+            return job
+        jobs_active.labels(QUEUED).inc()
+        self._start()
+        self._queue.put((job, key))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Stop a job. A queued job is never started, and a running one stops at
+        its next iteration.
+
+        :param job_id: The id of the job.
+        :return: The BackgroundJob, or None if there is no such job.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.control.cancel()
+        return job
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job, key = self._queue.get()
+            jobs_active.labels(QUEUED).dec()
+            if job.control.cancelled:
+                self._finish(job, CANCELLED)
+                continue
+            self._run(job, key)
+
+    def _run(self, job, key):
+        job.state = RUNNING
+        job.started = time.time()
+        jobs_active.labels(RUNNING).inc()
+        stats = {}
+        cost = None
+        try:
+            cost = self._admit(job)
+            job.control.start(self.pool.cpu_budget)
+            result = solver(job.problem, job.engine, stats, job.control)
+        except DeadlineExceeded:
+            self._finish(job, TIMEOUT, "TIMEOUT")
+        except Cancelled:
+            self._finish(job, CANCELLED)
+        except Exception:
+            self._finish(job, FAILED, "ERROR")
+        else:
+            self.pool.remember(key, job.problem, result)
+            self._finish(job, DONE, result, stats)
+        finally:
+            if cost is not None:
+                self.pool.admission.release(cost)
+            jobs_active.labels(RUNNING).dec()
+
+    def _admit(self, job):
+        if self.pool.admission is None:
+            return None
+        while True:
+            try:
+                return self.pool.admission.admit(job.problem, job.engine)
+            except SolverOverloaded:
+                # Keep waiting, unless the job has been cancelled or is out of time.
+                job.control.check(job.control.iterations)
+
+    def _finish(self, job, state, result=None, stats=None):
+        if stats is not None:
+            job.control.iterations = stats.get("iterations", job.control.iterations)
+            job.control.count(job.control.iterations)
+            if self.pool.observer is not None:
+                self.pool.observer(stats)
+        job.result = result
+        job.finished = time.time()
+        job.state = state
+        jobs_total.labels(state).inc()
+
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > self.retain:
+                self._jobs.pop(self._finished.popleft(), None)
+
@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+from numbers import Number
+
+from prometheus_client import Counter, Histogram
+
+STAGE_BUCKETS = (.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2000, 3000)
+
+stage_seconds = Histogram('solver_stage_seconds', 'Time spent in each stage of a request',
+                          ['stage'], buckets=STAGE_BUCKETS)
+search_iterations = Counter('solver_iterations_total', 'Search iterations performed by the solver',
+                            ['engine'])
+impossible_total = Counter('solver_impossible_total', 'Problems answered IMPOSSIBLE',
+                           ['reason'])
+rejections_total = Counter('prevalidation_rejections_total', 'Problems rejected before solving',
+                           ['reason'])
+problem_size = Histogram('solver_problem_size', 'Size of solved problems: colors (N), customers (M) '
+                         'and paints (the sum of T)', ['dimension'], buckets=SIZE_BUCKETS)
+
+
+def record_solve(stats):
+    """
+    Export the stats filled in by solver() for one problem, or by the pool
+    for one it rejected without solving.
+
+    :param stats: The stats dict from solver().
+    :return: Nothing.
+    """
+    for stage, seconds in stats.get("stages", {}).items():
+        stage_seconds.labels(stage).observe(seconds)
+    if "iterations" in stats:
+        search_iterations.labels(stats["engine"]).inc(stats["iterations"])
+    if "impossible" in stats:
+        impossible_total.labels(stats["impossible"]).inc()
+    if "rejected" in stats:
+        rejections_total.labels(stats["rejected"]).inc()
+    for dimension, size in stats.get("sizes", {}).items():
+        # Malformed requests can carry anything here.
+        if isinstance(size, Number) and not isinstance(size, bool):
+            problem_size.labels(dimension).observe(size)
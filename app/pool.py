@@ -0,0 +1,326 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from prometheus_client import Counter
+
+from cache import problem_key
+from solver.control import BudgetExceeded, Control
+from solver.prevalidate import prevalidate
+from solver.solver import solver
+
+
+coalesced_total = Counter('coalesced_requests_total',
+                          'Requests answered by a solve of the same problem already in flight', ['scope'])
+
+
+class SolverError(Exception):
+    # The response, and its HTTP status, given in place of a result when a job fails.
+    code = "ERROR"
+    status = 503
+
+
+class SolverTimeout(SolverError):
+    code = "TIMEOUT"
+
+
+class SolverCrashed(SolverError):
+    code = "ERROR"
+
+
+class SolverOverloaded(SolverError):
+    code = "OVERLOADED"
+
+
+class SolverTooLarge(SolverError):
+    code = "TOO_LARGE"
+    status = 413
+
+
+def solve_problem(problem, engine="greedy", cpu_budget=None):
+    # Runs in the worker processes, so must stay a module level function.
+    stats = {}
+    if not isinstance(problem, dict):
+        return "IMPOSSIBLE", stats
+    control = Control(cpu_budget=cpu_budget) if cpu_budget else None
+    try:
+        return solver(problem, engine, stats, control), stats
+    except BudgetExceeded:
+        raise SolverTimeout("Solve used more than %s seconds of CPU time" % cpu_budget)
+
+
+class Job:
+
+    def __init__(self, problem, future, executor, key=None, engine=None):
+        self.problem = problem
+        self.future = future
+        self.executor = executor
+        self.key = key
+        self.engine = engine
+
+
+class SolverPool:
+    """
+    Dispatches solver calls to a pool of worker processes so that concurrent
+    solves are not serialised on the GIL. With no workers, problems are
+    solved inline in the calling thread and timeouts are not enforced.
+
+    A job that outlives the timeout has its pool torn down and replaced, as a
+    running worker can't be interrupted. Jobs lost along with a crashed or
+    replaced pool are resubmitted once before giving up.
+
+    Problems the pre-validator rejects are answered IMPOSSIBLE straight away.
+    Given a ResultCache, problems already solved are answered from it without
+    reaching a worker, and new results are added to it. The observer, if
+    any, is called with the stats of every problem actually solved.
+
+    Problems are solved with the named engine (see solver.backends) unless
+    submitted with another.
+
+    With a cache, identical problems submitted while one is being solved wait
+    for that solve and share its result rather than being solved again. If
+    the cache has a directory, the same goes for problems being solved by
+    other processes using it.
+
+    Given an Admission, the solves that do need doing must first be admitted
+    by it, and are held to its CPU time budget.
+
+    Given a SolutionStore, problems are also looked up in it after the cache,
+    and every new result is recorded in it.
+    """
+
+    def __init__(self, workers=0, timeout=None, cache=None, observer=None, engine="greedy", admission=None,
+                 store=None):
+        self.workers = workers
+        self.engine = engine
+        self.timeout = timeout
+        self.cache = cache
+        self.store = store
+        self.observer = observer
+        self.admission = admission
+        self.cpu_budget = admission.cpu_budget if admission is not None else None
+        self.window = max(1, 2 * workers)
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._executor = ProcessPoolExecutor(workers) if workers > 0 else None
+
+    def submit(self, problem, engine=None):
+        """
+        Start solving a problem.
+
+        :param problem: A {colors, customers, demands} problem.
+        :param engine: The engine to use, if not the pool's own.
+        :return: A Job to pass to result().
+        """
+        key, result, stats = self.lookup(problem)
+        if result is not None:
+            if stats is not None and self.observer is not None:
+                self.observer(stats)
+            future = Future()
+            future.set_result((result, stats))
+            return Job(problem, future, None)
+
+        engine = engine or self.engine
+        flight = None
+        if key is not None:
+            with self._lock:
+                flight = self._flights.get((key, engine))
+                leader = flight is None
+                if leader:
+                    flight = self._flights[(key, engine)] = Future()
+            if not leader:
+                coalesced_total.labels('process').inc()
+                return Job(problem, flight, None, key, engine)
+
+        future = Future()
+        cost = None
+        try:
+            if self.admission is not None:
+                cost = self.admission.admit(problem, engine)
+        except SolverError as e:
+            future.set_exception(e)
+            self._settle(problem, key, engine, flight, None, None, future)
+            return Job(problem, future, None)
+
+        # Wait for any other process solving it, then see if it was solved.
+        lock = self.cache.claim(key) if key is not None and self.cache is not None else None
+        result = self.cache.get(key) if lock is not None else None
+        if result is not None:
+            coalesced_total.labels('shared').inc()
+            future.set_result((result, None))
+            self._settle(problem, key, engine, flight, lock, cost, future)
+            return Job(problem, future, None)
+        return self._submit(problem, key, engine, flight, lock, cost)
+
+    def lookup(self, problem):
+        """
+        Answer a problem without solving it, if it is rejected by the
+        pre-validator or already in the cache or store.
+
+        :param problem: A {colors, customers, demands} problem.
+        :return: The problem's key (or None without a cache or store), the
+                 result if known (or None), and the stats of a rejected
+                 problem.
+        """
+        start = time.time()
+        reason = prevalidate(problem)
+        if reason is not None:
+            stats = {"impossible": "prevalidation", "rejected": reason,
+                     "stages": {"prevalidate": time.time() - start}}
+            return None, "IMPOSSIBLE", stats
+
+        if self.cache is None and self.store is None:
+            return None, None, None
+        key = problem_key(problem)
+        if self.cache is not None:
+            result = self.cache.get(key)
+            if result is not None:
+                return key, result, None
+        if self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                if self.cache is not None:
+                    self.cache.put(key, result)
+                return key, result, None
+        return key, None, None
+
+    def remember(self, key, problem, result):
+        """
+        Add a new result to the cache and store.
+
+        :param key: The problem's key, or None.
+        :param problem: The problem solved.
+        :param result: Its result.
+        """
+        if key is None:
+            return
+        if self.cache is not None:
+            self.cache.put(key, result)
+        if self.store is not None:
+            self.store.put(key, problem, result)
+
+    def _submit(self, problem, key, engine, flight=None, lock=None, cost=None):
+        settle = partial(self._settle, problem, key, engine, flight, lock, cost)
+        if self._executor is None:
+            future = Future()
+            future.add_done_callback(settle)
+            try:
+                future.set_result(solve_problem(problem, engine, self.cpu_budget))
+            except Exception as e:
+                future.set_exception(e)
+            return Job(problem, future, None, key, engine)
+
+        with self._lock:
+            executor = self._executor
+        try:
+            future = executor.submit(solve_problem, problem, engine, self.cpu_budget)
+        except (BrokenProcessPool, RuntimeError):
+            # The pool broke (or was replaced) since we last looked at it.
+            self._restart(executor)
+            return self._submit(problem, key, engine, flight, lock, cost)
+        future.add_done_callback(settle)
+        return Job(problem, future, executor, key, engine)
+
+    def _settle(self, problem, key, engine, flight, lock, cost, future):
+        """
+        Record a finished solve, whoever is waiting for it: cache the result
+        before releasing the lock other processes wait on, give back what it
+        was admitted with, and hand it to the requests that joined the solve.
+        """
+        error = future.exception()
+        if error is None:
+            result, stats = future.result()
+            # Results found in the cache have no stats, and are already recorded.
+            if stats is not None:
+                self.remember(key, problem, result)
+                if self.observer is not None:
+                    self.observer(stats)
+        if lock is not None:
+            self.cache.release(lock)
+        if cost is not None:
+            self.admission.release(cost)
+        if flight is None:
+            return
+
+        with self._lock:
+            del self._flights[(key, engine)]
+        if error is None:
+            flight.set_result(future.result())
+        else:
+            flight.set_exception(error)
+
+    def result(self, job):
+        """
+        Wait for a job to finish.
+
+        :param job: A Job returned by submit().
+        :return: The solver result.
+        """
+        for attempt in range(2):
+            try:
+                result, stats = job.future.result(timeout=self.timeout)
+            except TimeoutError:
+                self._restart(job.executor)
+                raise SolverTimeout("Solve did not finish within %s seconds" % self.timeout)
+            except BrokenProcessPool:
+                # A worker died. Replace the pool and give the job one more go,
+                # admitted afresh and shared with any other retry of it, as the
+                # first go's admission and flight were settled when it broke.
+                self._restart(job.executor)
+                if attempt:
+                    raise SolverCrashed("Worker crashed while solving")
+                job = self.submit(job.problem, job.engine)
+            else:
+                return result
+
+    def solve(self, problem, engine=None):
+        return self.result(self.submit(problem, engine))
+
+    def map(self, problems, engine=None):
+        """
+        Solve a stream of problems, keeping a bounded number in flight and
+        yielding results in the order the problems arrived. Failed jobs yield
+        the error code in place of a result.
+
+        :param problems: An iterable of problems.
+        :param engine: The engine to use, if not the pool's own.
+        :return: A generator of results.
+        """
+        pending = deque()
+        for problem in problems:
+            pending.append(self.submit(problem, engine))
+            if len(pending) >= self.window:
+                yield self._result_or_code(pending.popleft())
+        while pending:
+            yield self._result_or_code(pending.popleft())
+
+    def _result_or_code(self, job):
+        try:
+            return self.result(job)
+        except SolverError as e:
+            return e.code
+
+    def _restart(self, executor):
+        with self._lock:
+            if executor is None or self._executor is not executor:
+                # Someone else has already replaced this pool.
+                return
+            self._executor = ProcessPoolExecutor(self.workers)
+
+        # Workers can't be interrupted, so stuck or orphaned ones are killed.
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
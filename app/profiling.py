@@ -0,0 +1,171 @@
+"""
+Profiling of individual solves, on request or for a sample of them. The
+solve runs in the serving thread under cProfile, and its profile is saved
+alongside the exact problem, so that a slow request can be examined and
+replayed later (see replay.py) without needing the original URL. Profiles
+are pstats files, which snakeviz, flameprof and the like turn into flame
+graphs.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import json
+import time
+import uuid
+import random
+import cProfile
+import threading
+
+from prometheus_client import Counter
+
+from pool import SolverError, SolverTimeout
+from solver.control import Control, DeadlineExceeded
+from solver.solver import Preferences, solver
+
+profiles_total = Counter('profiles_total', 'Solves run under the profiler')
+
+# Only one profiler may be active in a process (Python 3.12 refuses a second).
+_profiling = threading.Lock()
+
+
+class ProfilerBusy(SolverError):
+    code = "PROFILER_BUSY"
+    status = 409
+
+
+def encode_problem(problem):
+    """
+    :param problem: A {colors, customers, demands} problem, as parsed.
+    :return: The problem as JSON, with packed demands kept packed.
+    """
+    demands = problem.get("demands")
+    if isinstance(demands, Preferences):
+        demands = {"packed": demands.to_bytes().hex()}
+    return dict(problem, demands=demands)
+
+
+def decode_problem(captured):
+    """
+    :param captured: A problem as returned by encode_problem.
+    :return: The problem as it was given to the solver.
+    """
+    demands = captured.get("demands")
+    if isinstance(demands, dict) and "packed" in demands:
+        demands = Preferences.from_bytes(bytes(bytearray.fromhex(demands["packed"])))
+    return dict(captured, demands=demands)
+
+
+def profile_solve(problem, engine, control=None):
+    """
+    :param problem: A {colors, customers, demands} problem.
+    :param engine: The engine to solve it with.
+    :param control: Optional Control to hold the solve to.
+    :return: The result, the solve's stats and its cProfile.Profile.
+    """
+    stats = {}
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        result = solver(problem, engine, stats, control)
+    finally:
+        profile.disable()
+    return result, stats, profile
+
+
+class Profiler:
+    """
+    Solves problems under the profiler, keeping the most recent captures in
+    a directory. Each capture is an ID.prof profile and an ID.json holding
+    the problem, engine, result and timings; IDs sort by capture time.
+
+    A profiled solve is held to the same rules as any other: problems the
+    pool can answer without solving aren't profiled, the rest must be
+    admitted, the solve is stopped at the pool's timeout or CPU budget, and
+    its stats go to the pool's observer.
+
+    One solve is profiled at a time. While one is, a request that asked to
+    be profiled is refused with ProfilerBusy, and a sampled one is solved by
+    the pool as usual.
+    """
+
+    def __init__(self, directory, rate=0.0, retain=100):
+        """
+        :param directory: Where captures are kept.
+        :param rate: The fraction of requests profiled unasked.
+        :param retain: The number of captures kept; older ones are deleted.
+        """
+        self.directory = directory
+        self.rate = rate
+        self.retain = retain
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def sample(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def solve(self, problem, engine, pool, requested=True):
+        """
+        :param problem: A {colors, customers, demands} problem.
+        :param engine: The engine to solve it with.
+        :param pool: The SolverPool whose cache, admission and limits apply.
+        :param requested: Whether the request asked to be profiled, rather
+                          than being sampled.
+        :return: The result and the capture's ID, or None if the problem
+                 was answered without profiling it.
+        """
+        key, result, stats = pool.lookup(problem)
+        if result is not None:
+            if stats is not None and pool.observer is not None:
+                pool.observer(stats)
+            return result, None
+
+        if not _profiling.acquire(False):
+            if requested:
+                raise ProfilerBusy("Another solve is being profiled")
+            return pool.solve(problem, engine), None
+        try:
+            result, stats, profile, seconds = self._profile(problem, engine, pool)
+        finally:
+            _profiling.release()
+        pool.remember(key, problem, result)
+        if pool.observer is not None:
+            pool.observer(stats)
+        profiles_total.inc()
+
+        capture_id = "%d-%s" % (time.time() * 1000, uuid.uuid4().hex[:8])
+        path = os.path.join(self.directory, capture_id)
+        profile.dump_stats(path + ".prof")
+        with open(path + ".json", 'w') as f:
+            json.dump({"problem": encode_problem(problem), "engine": engine, "result": result,
+                       "seconds": seconds, "stats": stats}, f)
+        self.prune()
+        return result, capture_id
+
+    def _profile(self, problem, engine, pool):
+        cost = pool.admission.admit(problem, engine) if pool.admission is not None else None
+        control = Control(pool.timeout, pool.cpu_budget)
+        start = time.time()
+        try:
+            result, stats, profile = profile_solve(problem, engine, control)
+        except DeadlineExceeded:
+            raise SolverTimeout("Profiled solve passed its time limit")
+        finally:
+            if cost is not None:
+                pool.admission.release(cost)
+        return result, stats, profile, time.time() - start
+
+    def prune(self):
+        with self._lock:
+            captures = sorted(name[:-len(".json")] for name in os.listdir(self.directory)
+                              if name.endswith(".json"))
+            for capture_id in captures[:max(0, len(captures) - self.retain)]:
+                for suffix in (".json", ".prof"):
+                    try:
+                        os.remove(os.path.join(self.directory, capture_id + suffix))
+                    except OSError:
+                        # Already pruned by another process.
+                        pass
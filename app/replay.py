@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#usage: ./replay.py profiles/1790000000000-0a1b2c3d.json [--engine exhaustive] [--sort tottime] [--output replay.prof]
+"""
+Replay a problem captured by the profiler (see profiling.py) offline: it is
+solved again under cProfile exactly as it was in the service, and the
+profile's top entries are printed. By default the engine the request used
+is replayed; --engine exhaustive runs the problem through Check and
+Optimise instead, for comparison.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import sys
+import json
+import time
+import pstats
+import argparse
+
+from profiling import decode_problem, profile_solve
+from solver.solver import BACKENDS, solver
+
+
+def main(args):
+    with open(args.capture) as f:
+        capture = json.load(f)
+    engine = args.engine or capture["engine"]
+    problem = decode_problem(capture["problem"])
+
+    # Solve once first so that lazy imports don't show up in the profile.
+    solver(problem, engine)
+    start = time.time()
+    result, stats, profile = profile_solve(problem, engine)
+    seconds = time.time() - start
+
+    print("engine %s: %.6fs (captured %s: %.6fs)" % (engine, seconds, capture["engine"], capture["seconds"]))
+    print("result %s" % ("matches" if result == capture["result"] else "differs: %s" % result))
+    if args.output:
+        profile.dump_stats(args.output)
+    pstats.Stats(profile, stream=sys.stdout).sort_stats(args.sort).print_stats(args.limit)
+    return 0 if result == capture["result"] else 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'capture',
+        type=str,
+        help='the .json file of a capture'
+    )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default=None,
+        choices=sorted(BACKENDS),
+        help='the engine to replay with, if not the one captured'
+    )
+    parser.add_argument(
+        '--sort',
+        type=str,
+        default='cumulative',
+        help='the pstats sort order'
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=30,
+        help='the number of profile entries printed'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='a file to save the replayed profile to'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#usage: ./serve.py --port 8080 --monitor 8081 --processes 4 --threads 8 --stateless
+"""
+Serve the app in production, under gunicorn rather than Flask's
+development server.
+
+The app and the solver modules (NumPy and pandas included) are imported,
+and a small problem solved, once in the master process before the workers
+are forked, so every worker starts warm and shares that state copy-on-write.
+Each worker then builds its own solver pool, cache and job threads, which
+don't survive a fork.
+
+Sessions and background jobs are held by the worker that created them, and
+the next request for one may reach another worker, so with more than one
+process they must be turned off with --stateless.
+
+Metrics from all the workers are collected through Prometheus'
+multiprocess mode and served by the master on the monitoring port. Sending
+the master SIGHUP (or calling /crash) replaces the workers gracefully:
+requests in flight are finished before a worker exits.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import signal
+import shutil
+import tempfile
+
+# Must be set before prometheus_client is first imported.
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='paintshop-metrics-')
+    os.environ['prometheus_multiproc_dir'] = os.environ['PROMETHEUS_MULTIPROC_DIR']
+
+from gunicorn.app.base import BaseApplication
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+import app as paintshop
+from solver.solver import solver
+
+
+class Server(BaseApplication):
+
+    def __init__(self, args):
+        self.args = args
+        BaseApplication.__init__(self)
+
+    def load_config(self):
+        args = self.args
+        settings = {
+            'bind': '0.0.0.0:%d' % args.port,
+            'workers': args.processes,
+            'threads': args.threads,
+            'worker_class': 'gthread' if args.threads > 1 else 'sync',
+            'timeout': args.worker_timeout,
+            'graceful_timeout': args.graceful_timeout,
+            'pidfile': args.pidfile,
+            'preload_app': True,
+            'when_ready': self.when_ready,
+            'post_fork': self.post_fork,
+            'child_exit': self.child_exit,
+            'on_exit': self.on_exit,
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        warm()
+        return paintshop.app
+
+    def when_ready(self, server):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(self.args.monitor, registry=registry)
+
+    def post_fork(self, server, worker):
+        paintshop.configure(self.args)
+        # Reloading is the production equivalent of crashing the dev server.
+        paintshop.app.config['shutdown'] = lambda: os.kill(os.getppid(), signal.SIGHUP)
+
+    def child_exit(self, server, worker):
+        multiprocess.mark_process_dead(worker.pid)
+
+    def on_exit(self, server):
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def warm():
+    # Run every stage once so that nothing is left to load in the workers.
+    for engine in ("greedy", "exhaustive"):
+        solver({"colors": 2, "customers": 2, "demands": [[1, 1, 1], [2, 1, 0, 2, 0]]}, engine=engine)
+
+
+def parse_args(argv=None):
+    parser = paintshop.build_parser()
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='the number of serving processes (more than one needs --stateless)'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=4,
+        help='the number of request threads in each serving process'
+    )
+    parser.add_argument(
+        '--worker-timeout',
+        type=int,
+        default=60,
+        help='the number of seconds a serving process may be unresponsive before it is restarted'
+    )
+    parser.add_argument(
+        '--graceful-timeout',
+        type=int,
+        default=30,
+        help='the number of seconds given to requests in flight when reloading or stopping'
+    )
+    parser.add_argument(
+        '--pidfile',
+        type=str,
+        default=None,
+        help='a file to write the master process id to, for sending it SIGHUP'
+    )
+    args = parser.parse_args(argv)
+    if args.processes > 1 and not args.stateless:
+        parser.error("sessions and jobs can't be shared between processes: "
+                     "give --stateless or use one process")
+    return args
+
+
+if __name__ == '__main__':
+    Server(parse_args()).run()
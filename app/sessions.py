@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+sessions_evicted = Counter('sessions_evicted_total', 'Sessions dropped to make room or for being idle', ['cause'])
+
+
+class Sessions:
+    """
+    Problem sessions by id, each with a lock as edits to a session can't
+    overlap. At most `maxsize` are kept, the least recently used going first
+    to make room, and a session not used for `ttl` seconds is dropped.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session):
+        """
+        :param session: A solver.session.Session.
+        :return: Its new id.
+        """
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._entries[session_id] = (threading.Lock(), session, time.time())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                sessions_evicted.labels('full').inc()
+        return session_id
+
+    def get(self, session_id):
+        """
+        :param session_id: An id returned by add().
+        :return: The session's lock and the session, or None if there is no
+                 such session or it has expired.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            lock, session, _ = entry
+            self._entries[session_id] = (lock, session, time.time())
+            self._entries.move_to_end(session_id)
+            return lock, session
+
+    def pop(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self):
+        # The least recently used are first, so stop at the first still in use.
+        if not self.ttl:
+            return
+        idle_since = time.time() - self.ttl
+        while self._entries:
+            session_id, (_, _, used) = next(iter(self._entries.items()))
+            if used > idle_since:
+                return
+            del self._entries[session_id]
+            sessions_evicted.labels('idle').inc()
@@ -0,0 +1,105 @@
+"""
+The solver engines, by name. A backend validates a problem and then
+searches it; solver() looks the engine up here, so adding an engine is a
+matter of registering a class with the same two methods. Each also gives a
+rough estimate of what a solve will cost from the size of the problem,
+which the service uses to decide whether to take the problem on.
+"""
+
+from preferences import Preferences
+from propagate import Propagate
+from validate import Validate
+
+BACKENDS = {}
+
+
+def register(backend):
+    """
+    Make a backend class available to solver() under its name.
+
+    :param backend: A class with a name, check(), search() and estimate().
+    :return: The class, so this can be used as a decorator.
+    """
+    BACKENDS[backend.name] = backend
+    return backend
+
+
+def get_backend(name):
+    """
+    :param name: The name of a registered backend.
+    :return: An instance of the backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown solver engine: %s" % name)
+    return BACKENDS[name]()
+
+
+@register
+class Greedy:
+    """
+    Propagates forced mattes from the customers left without a glossy
+    option. Linear in the number of paints; the default.
+    """
+
+    name = "greedy"
+
+    def check(self, colors, customers, demands):
+        """
+        :return: A Validate that has been run, with possible, solution and prefs.
+        """
+        return Validate(colors, customers, demands).check()
+
+    def search(self, check, control=None):
+        """
+        :param check: The result of check(), for a possible problem.
+        :param control: Optional Control to report progress to.
+        :return: The search, with possible, solution and iterations.
+        """
+        opt = Propagate(check.colors, check.customers, check.prefs, control)
+        opt.propagate()
+        return opt
+
+    def estimate(self, colors, customers, paints):
+        """
+        :param colors: N, the number of colors.
+        :param customers: M, the number of customers.
+        :param paints: The sum of T, the number of paints customers like.
+        :return: The rough CPU seconds and bytes of memory a solve needs.
+        """
+        size = colors + customers + paints
+        return 4e-4 + 1e-6 * size, 100 * size
+
+
+@register
+class Exhaustive:
+    """
+    Tries every combination of finishes, fewest mattes first. Exponential in
+    the number of undecided colors, so kept as a reference for cross-checking
+    other backends on small problems.
+    """
+
+    name = "exhaustive"
+
+    def check(self, colors, customers, demands):
+        # Imported here as Check brings pandas with it.
+        from check import Check
+
+        if isinstance(demands, Preferences):
+            # Check only reads customer arrays.
+            demands = demands.to_demands()
+        return Check(colors, customers, demands).check()
+
+    def search(self, check, control=None):
+        from optimise import Optimise
+
+        opt = Optimise(check.colors, check.customers, check.solution, check.prefs, control)
+        opt.iterate_all_combinations()
+        return opt
+
+    def estimate(self, colors, customers, paints):
+        # The worst case: no color is decided before the search, which
+        # checks every paint for each combination. Check builds a pandas
+        # Series for every paint and a DataFrame of them, about 3.3KB a
+        # paint; the search itself holds only arrays over the paints.
+        seconds = 0.1 + 1e-6 * paints * 2.0 ** min(colors, 64)
+        return seconds, 100000 + 3500 * paints
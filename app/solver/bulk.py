@@ -0,0 +1,244 @@
+"""
+Solve many problems together. Every problem's customer arrays are
+concatenated into one set of arrays, with offsets recording where each
+problem's customers and colors start, so that Validate's rules and the
+greedy propagation each run as a handful of NumPy passes over all of the
+problems at once. For batches of small problems this replaces the fixed
+cost of validating and solving each problem separately, which dominates
+when N is in the tens, with a few tens of microseconds per problem.
+
+The answers are those solver() gives with the greedy engine.
+"""
+
+import numpy as np
+
+from itertools import chain
+
+from preferences import Preferences
+
+MAX_COLORS = 2000
+MAX_CUSTOMERS = 2000
+MAX_PAINT_COMBOS = 3000
+
+
+def bulk_solve(problems):
+    """
+    :param problems: A list of {colors, customers, demands} problems.
+    :return: The solution string, or "IMPOSSIBLE", for each problem.
+    """
+    results = ["IMPOSSIBLE"] * len(problems)
+    batch = Batch()
+    for i, problem in enumerate(problems):
+        if not isinstance(problem, dict):
+            continue
+        demands = problem.get("demands")
+        if isinstance(demands, Preferences):
+            if not demands.is_well_formed():
+                # As Validate finds.
+                continue
+            # Packed requests join the batch as customer arrays.
+            problem = dict(problem, demands=demands.to_demands())
+        batch.add(i, problem)
+
+    if batch.index:
+        for i, result in batch.solve():
+            results[i] = result
+    return results
+
+
+class Batch:
+    """
+    The concatenated arrays of the problems being solved together. Problems
+    ruled out by a check are dropped from the arrays before the next, so
+    that every pass sees only data that passed the checks before it.
+    """
+
+    def __init__(self):
+        self.index = []
+        self.colors = []
+        self.flats = []
+        self.lengths = []
+
+    def add(self, index, problem):
+        # The checks that can't be made on arrays: types and list shapes.
+        colors = problem.get("colors")
+        customers = problem.get("customers")
+        demands = problem.get("demands")
+        if not isinstance(colors, int) or not isinstance(customers, int) or \
+                isinstance(colors, bool) or isinstance(customers, bool) or \
+                not 1 <= colors <= MAX_COLORS or not 1 <= customers <= MAX_CUSTOMERS or \
+                not isinstance(demands, list) or len(demands) != customers or colors < customers:
+            return
+        if set(map(type, demands)) - {list} and not all(isinstance(customer, list) for customer in demands):
+            return
+
+        self.index.append(index)
+        self.colors.append(colors)
+        self.flats.append(list(chain.from_iterable(demands)))
+        self.lengths.append(list(map(len, demands)))
+
+    def solve(self):
+        """
+        :return: (index, result) for each problem added, in the order added.
+        """
+        n_probs = len(self.index)
+        colors = np.array(self.colors, dtype=np.int64)
+        values = self.ingest(self.flats)
+        ok = np.ones(n_probs, dtype=bool)
+        if values is None:
+            ok = self.ingest_each()
+            values = self.ingest(self.keep(self.flats, ok))
+        lengths = self.keep(self.lengths, ok)
+        cust_probs = np.repeat(np.flatnonzero(ok), list(map(len, lengths)))
+        lengths = np.fromiter(chain.from_iterable(lengths), dtype=np.int64)
+
+        # Every customer array must have an odd length.
+        bad = self.by_problem(cust_probs, lengths % 2 != 1, n_probs)
+        values, lengths, cust_probs = self.drop(ok, bad, values, lengths, cust_probs)
+
+        # Values must be positive, and each T must match its customer's pairs.
+        starts = np.cumsum(lengths) - lengths
+        bad = self.by_problem(np.repeat(cust_probs, lengths), values < 0, n_probs)
+        bad |= self.by_problem(cust_probs, values[starts] != (lengths - 1) // 2, n_probs)
+
+        position = np.arange(len(values)) - np.repeat(starts, lengths)
+        pair_custs = np.repeat(np.arange(len(lengths)), (lengths - 1) // 2)
+        pair_probs = cust_probs[pair_custs]
+        paint_colors = values[position % 2 == 1] - 1
+        finishes = values[(position > 0) & (position % 2 == 0)]
+
+        # Colors must be within range, and finishes binary.
+        bad |= self.by_problem(pair_probs, (paint_colors < 0) | (paint_colors >= colors[pair_probs]), n_probs)
+        bad |= self.by_problem(pair_probs, finishes > 1, n_probs)
+        ok &= ~bad
+
+        keep = ok[pair_probs]
+        pair_custs, pair_probs = pair_custs[keep], pair_probs[keep]
+        paint_colors, finishes = paint_colors[keep], finishes[keep]
+        ok &= ~self.check_paints(colors, cust_probs, pair_custs, pair_probs, paint_colors, finishes)
+
+        # Number every color of every problem in one sequence.
+        color_starts = np.cumsum(colors) - colors
+        keep = ok[pair_probs]
+        matte = self.propagate(color_starts[pair_probs[keep]] + paint_colors[keep], finishes[keep],
+                               pair_custs[keep], cust_probs, int(colors.sum()), ok)
+
+        # Lay out every solution as "0 1 0 ..." text at once.
+        text = np.full(2 * len(matte), ord(" "), dtype=np.uint8)
+        text[::2] = matte + ord("0")
+        text = text.tobytes().decode("ascii")
+        return [(index, text[2 * start:2 * (start + n) - 1] if possible else "IMPOSSIBLE")
+                for index, start, n, possible in zip(self.index, color_starts.tolist(), self.colors, ok.tolist())]
+
+    @staticmethod
+    def keep(items, ok):
+        return [item for item, keep in zip(items, ok.tolist()) if keep]
+
+    @staticmethod
+    def ingest(flats):
+        """
+        As in Validate.ingest, all values must be integers (or booleans).
+
+        :param flats: The flattened customer arrays of each problem.
+        :return: The values of the problems concatenated, or None if they
+                 aren't all integers.
+        """
+        try:
+            values = np.array(list(chain.from_iterable(flats)), dtype=None if flats else np.int64)
+        except (ValueError, TypeError):
+            # Nested or otherwise ragged customer arrays.
+            return None
+        if values.dtype.kind not in 'biu' or values.ndim != 1:
+            return None
+        return values.astype(np.int64)
+
+    def ingest_each(self):
+        # Some problem isn't all integers; find which, one problem at a time.
+        ok = []
+        for flat in self.flats:
+            try:
+                values = np.array(flat)
+                ok.append(values.dtype.kind in 'biu' and values.ndim == 1)
+            except (ValueError, TypeError):
+                ok.append(False)
+        return np.array(ok, dtype=bool)
+
+    @staticmethod
+    def by_problem(probs, flags, n_probs):
+        # Whether any flag is set for each problem.
+        return np.bincount(probs[flags], minlength=n_probs) > 0
+
+    @staticmethod
+    def drop(ok, bad, values, lengths, cust_probs):
+        # Rule out the bad problems and remove their customers.
+        ok &= ~bad
+        if not bad.any():
+            return values, lengths, cust_probs
+        keep = ok[cust_probs]
+        return values[np.repeat(keep, lengths)], lengths[keep], cust_probs[keep]
+
+    def check_paints(self, colors, cust_probs, pair_custs, pair_probs, paint_colors, finishes):
+        """
+        Validate.check_paints and check_limits, for every problem at once.
+
+        :return: Which problems break the rules.
+        """
+        n_probs = len(colors)
+        n_custs = len(cust_probs)
+
+        # Too many matte finishes per customer specified.
+        too_many = np.bincount(pair_custs, weights=finishes, minlength=n_custs) > 1
+        bad = self.by_problem(cust_probs, too_many, n_probs)
+
+        # Duplicate entries of color and finish specified.
+        keys = np.sort((pair_custs * MAX_COLORS + paint_colors) * 2 + finishes)
+        duplicate = keys[1:] == keys[:-1]
+        bad |= self.by_problem(cust_probs[keys[1:] // (2 * MAX_COLORS)], duplicate, n_probs)
+
+        # Customers competing for the same paint specifications.
+        color_starts = np.cumsum(colors) - colors
+        paints = (color_starts[pair_probs] + paint_colors) * 2 + finishes
+        single = (np.bincount(pair_custs, minlength=n_custs) == 1)[pair_custs]
+        n_total = np.bincount(paints, minlength=2 * int(colors.sum()))
+        n_single = np.bincount(paints[single], minlength=2 * int(colors.sum()))
+        competing = (n_total > 1) & (n_single == n_total)
+        bad |= self.by_problem(np.repeat(np.arange(n_probs), 2 * colors), competing, n_probs)
+
+        # The total number of paint choices is limited.
+        bad |= np.bincount(pair_probs, minlength=n_probs) > MAX_PAINT_COMBOS
+        return bad
+
+    def propagate(self, paint_colors, finishes, pair_custs, cust_probs, n_colors, ok):
+        """
+        Propagate.propagate for every problem at once. Each pass forces the
+        mattes of all the customers, in every problem, who have just run out
+        of glossy options.
+
+        :return: The solutions, concatenated. Problems left with an
+                 unsatisfied customer are marked not ok.
+        """
+        n_custs = len(cust_probs)
+        matte_of = np.full(n_custs, -1, dtype=np.int64)
+        matte_of[pair_custs[finishes == 1]] = paint_colors[finishes == 1]
+        glossy = finishes == 0
+        glossy_custs, glossy_colors = pair_custs[glossy], paint_colors[glossy]
+        glossy_count = np.bincount(glossy_custs, minlength=n_custs)
+
+        solution = np.zeros(n_colors, dtype=np.uint8)
+        frontier = np.flatnonzero((glossy_count == 0) & ok[cust_probs])
+        while frontier.size:
+            forced = matte_of[frontier]
+            # All of these customers' glossy paints went matte and they have no matte.
+            ok[cust_probs[frontier[forced < 0]]] = False
+
+            forced = forced[forced >= 0]
+            forced = np.unique(forced[solution[forced] == 0])
+            solution[forced] = 1
+
+            # Everyone who liked these colors glossy has lost an option.
+            newly = np.zeros(n_colors, dtype=bool)
+            newly[forced] = True
+            lost = np.bincount(glossy_custs[newly[glossy_colors]], minlength=n_custs)
+            glossy_count -= lost
+            frontier = np.flatnonzero((lost > 0) & (glossy_count == 0))
+        return solution
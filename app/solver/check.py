@@ -1,6 +1,10 @@
+import time
+
 import numpy as np
 import pandas as pd
 
+from preferences import Preferences
+
 
 class Check:
 
@@ -11,8 +15,8 @@ class Check:
         self.request = request
         self.possible = True
         self.solution = np.full(self.colors, np.NaN)
-        self.nd_arr = np.empty((self.customers, self.colors, 2))
-        self.nd_arr.fill(np.NaN)
+        self.prefs = None
+        self.timings = {}
         self.max_paint_combos = 3000
         self.max_customers = 2000
         self.max_colors = 2000
@@ -24,7 +28,9 @@ class Check:
         for method in calls:
             # We only need to do subsequent checks if things are not impossible thus far.
             if self.possible:
+                start = time.time()
                 method()
+                self.timings[method.__name__] = time.time() - start
         return self
 
     def convert_request_to_df(self):
@@ -37,11 +43,10 @@ class Check:
                 # Create a new customer.
                 df.append(pd.Series([i, color, finish, n_paints, np.NaN, np.NaN],
                                     index=columns))
-                # Update entry in 3D array.
-                self.nd_arr[i, color - 1, finish] = True
 
-        # Create dataframe.
-        self.df = pd.DataFrame(df)
+        # Create dataframe and sparse preferences.
+        self.df = pd.DataFrame(df, columns=columns)
+        self.prefs = Preferences.from_demands(self.colors, self.request)
 
     def enrich_df(self):
         for color, group in self.df.groupby('color'):
@@ -72,7 +77,7 @@ class Check:
             # T must be correctly specified.
             # logger.info("T incorrectly specified")
             self.possible = False
-        if any([i > self.colors for i in customer[1::2]]):
+        if any([i < 1 or i > self.colors for i in customer[1::2]]):
             # Specified colors must be within permissible range.
             # logger.info("Specified colors outside of permissible range.")
             self.possible = False
@@ -109,11 +114,11 @@ class Check:
 
     def check_nd_arr(self):
         # The total number of paint choices must be less than 3000.
-        if np.sum(np.sum(np.nansum(self.nd_arr, axis=1), axis=1)) > self.max_paint_combos:
+        if len(self.prefs) > self.max_paint_combos:
             self.possible = False
 
         # Find unliked paint colors and set these to 0 in base solution.
-        unliked = np.sum(np.nansum(self.nd_arr, axis=0), axis=1)
+        unliked = np.bincount(self.prefs.paint_colors, minlength=self.colors)
         self.solution[unliked == 0] = 0
 
     def check_df(self):
@@ -0,0 +1,60 @@
+from __future__ import print_function, division
+
+import time
+
+# The CPU time used by the calling thread. Python 2 has no per-thread clock.
+thread_time = getattr(time, 'thread_time', time.time)
+
+
+class Cancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(Cancelled):
+    pass
+
+
+class BudgetExceeded(DeadlineExceeded):
+    pass
+
+
+class Control:
+    """
+    Lets another thread follow and stop a solve. The search loops report
+    their progress through check(), which raises Cancelled once cancel() has
+    been called, or DeadlineExceeded once the deadline has passed, so a solve
+    stops at the next iteration rather than running to completion. A CPU
+    time budget is measured on the thread the Control was made on, which
+    must be the one that runs the solve.
+    """
+
+    def __init__(self, deadline=None, cpu_budget=None):
+        """
+        :param deadline: The number of seconds the solve may take, or None.
+        :param cpu_budget: The number of seconds of CPU time the solve may
+                           use, or None.
+        """
+        self.deadline = time.time() + deadline if deadline else None
+        self.cpu_limit = thread_time() + cpu_budget if cpu_budget else None
+        self.cancelled = False
+        self.iterations = 0
+        self.best_fitness = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self, iterations, best_fitness=None):
+        """
+        :param iterations: The number of search iterations done so far.
+        :param best_fitness: The number of mattes in the best solution so far, if any.
+        :return: Nothing.
+        """
+        self.iterations = iterations
+        if best_fitness is not None:
+            self.best_fitness = best_fitness
+        if self.cancelled:
+            raise Cancelled("Solve cancelled")
+        if self.deadline is not None and time.time() > self.deadline:
+            raise DeadlineExceeded("Solve passed its deadline")
+        if self.cpu_limit is not None and thread_time() > self.cpu_limit:
+            raise BudgetExceeded("Solve used up its CPU time budget")
@@ -0,0 +1,152 @@
+import numpy as np
+
+# Packed requests are little-endian int32 throughout.
+PACKED_DTYPE = np.dtype('<i4')
+PACKED_HEADER = 3
+
+
+def as_ints(values, dtype):
+    # Integer arrays are used as they are, so packed buffers are never copied.
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return values
+    return np.asarray(values, dtype=dtype)
+
+
+class Preferences:
+    """
+    Compressed (CSR-style) store of every paint preference in a request.
+    The paints liked by customer i are held in colors[offsets[i]:offsets[i + 1]]
+    and finishes[offsets[i]:offsets[i + 1]]. Colors are zero-based.
+    """
+
+    def __init__(self, colors, offsets, paint_colors, finishes):
+        self.colors = colors
+        self.customers = len(offsets) - 1
+        self.offsets = as_ints(offsets, np.int32)
+        self.paint_colors = as_ints(paint_colors, np.int32)
+        self.finishes = as_ints(finishes, np.int8)
+        self._by_color = None
+        self._keys = None
+
+    @classmethod
+    def from_demands(cls, colors, demands):
+        """
+        Build preferences from a validated request.
+
+        :param colors: The number of paint colors.
+        :param demands: A list of [T, X, Y, X, Y, ...] customer arrays.
+        :return: A Preferences instance.
+        """
+        flat = [value for customer in demands for value in customer]
+        lengths = np.array([len(customer) for customer in demands], dtype=np.int64)
+        return cls.from_flat(colors, np.array(flat, dtype=np.int64), lengths)
+
+    @classmethod
+    def from_flat(cls, colors, values, lengths):
+        """
+        Build preferences from the flattened request, i.e. every customer
+        array concatenated into values, with lengths holding the size of each.
+
+        :param colors: The number of paint colors.
+        :param values: Concatenated [T, X, Y, X, Y, ...] customer arrays.
+        :param lengths: The length of each customer array.
+        :return: A Preferences instance.
+        """
+        starts = np.cumsum(lengths) - lengths
+
+        # Position of every value within its own customer array.
+        position = np.arange(len(values)) - np.repeat(starts, lengths)
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum((lengths - 1) // 2)
+
+        paint_colors = values[(position % 2 == 1)] - 1
+        finishes = values[(position > 0) & (position % 2 == 0)]
+        return cls(colors, offsets, paint_colors, finishes)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        """
+        Decode a packed request without copying it. The buffer holds int32
+        values: colors, customers and the number of paints P, then the
+        customers + 1 offsets, the P zero-based colors and the P finishes.
+
+        :param buffer: A bytes-like packed request.
+        :return: A Preferences instance viewing the buffer.
+        """
+        if len(buffer) < PACKED_HEADER * PACKED_DTYPE.itemsize:
+            raise ValueError("Packed request is too short")
+        colors, customers, paints = np.frombuffer(buffer, dtype=PACKED_DTYPE, count=PACKED_HEADER).tolist()
+        if customers < 0 or paints < 0 or \
+                len(buffer) != PACKED_DTYPE.itemsize * (PACKED_HEADER + customers + 1 + 2 * paints):
+            raise ValueError("Packed request length doesn't match its header")
+
+        values = np.frombuffer(buffer, dtype=PACKED_DTYPE, offset=PACKED_HEADER * PACKED_DTYPE.itemsize)
+        offsets = values[:customers + 1]
+        return cls(colors, offsets, values[customers + 1:customers + 1 + paints], values[customers + 1 + paints:])
+
+    def to_bytes(self):
+        header = [self.colors, self.customers, len(self)]
+        return b''.join(np.asarray(values).astype(PACKED_DTYPE).tobytes()
+                        for values in (header, self.offsets, self.paint_colors, self.finishes))
+
+    def is_well_formed(self):
+        # Offsets must delimit every paint, in order.
+        offsets = self.offsets
+        return len(offsets) > 0 and offsets[0] == 0 and not np.any(np.diff(offsets) < 0) and \
+            offsets[-1] == len(self) and len(self.finishes) == len(self)
+
+    def to_demands(self):
+        # Back to [T, X, Y, X, Y, ...] customer arrays.
+        demands = []
+        for cust_id in range(self.customers):
+            colors, finishes = self.customer(cust_id)
+            pairs = zip((colors + 1).tolist(), finishes.tolist())
+            demands.append([len(colors)] + [i for pair in pairs for i in pair])
+        return demands
+
+    @property
+    def n_paints(self):
+        # The number of paints each customer likes.
+        return np.diff(self.offsets)
+
+    @property
+    def cust_ids(self):
+        # The customer each paint preference belongs to.
+        return np.repeat(np.arange(self.customers, dtype=np.int32), self.n_paints)
+
+    def __len__(self):
+        return len(self.paint_colors)
+
+    def by_color(self):
+        """
+        Index the preferences by color as well as by customer. Built on first
+        use and cached, so each request only pays for the views it needs.
+
+        :return: Color offsets, and the customer and finish of each preference
+                 ordered by color.
+        """
+        if self._by_color is None:
+            order = np.argsort(self.paint_colors, kind='stable')
+            color_offsets = np.zeros(self.colors + 1, dtype=np.int32)
+            color_offsets[1:] = np.cumsum(np.bincount(self.paint_colors, minlength=self.colors))
+            self._by_color = (color_offsets, self.cust_ids[order], self.finishes[order])
+        return self._by_color
+
+    def customer(self, cust_id):
+        # The colors and finishes liked by a customer.
+        start, end = self.offsets[cust_id], self.offsets[cust_id + 1]
+        return self.paint_colors[start:end], self.finishes[start:end]
+
+    def color(self, color):
+        # The customers who like a color, and the finish they like it in.
+        color_offsets, color_custs, color_finishes = self.by_color()
+        start, end = color_offsets[color], color_offsets[color + 1]
+        return color_custs[start:end], color_finishes[start:end]
+
+    def likes(self, cust_id, color, finish):
+        # Does this customer like this paint spec?
+        if self._keys is None:
+            keys = (self.cust_ids.astype(np.int64) * self.colors + self.paint_colors) * 2 + self.finishes
+            self._keys = set(keys.tolist())
+        return (cust_id * self.colors + color) * 2 + finish in self._keys
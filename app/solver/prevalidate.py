@@ -0,0 +1,126 @@
+"""
+A cheap first pass over a decoded problem that rejects malformed or
+obviously infeasible requests before any arrays are built. It walks the
+request once, stops as soon as it finds a problem, and never looks at more
+than the documented limits allow, so garbage costs no more than a valid
+request of the same size. Anything it rejects is a problem solver() would
+answer IMPOSSIBLE.
+"""
+
+NOT_AN_OBJECT = "not_an_object"
+BAD_COUNTS = "bad_counts"
+TOO_FEW_COLORS = "too_few_colors"
+CUSTOMER_MISMATCH = "customer_count_mismatch"
+TOO_MANY_PAINTS = "too_many_paints"
+MALFORMED_CUSTOMER = "malformed_customer"
+COLOR_OUT_OF_RANGE = "color_out_of_range"
+BAD_FINISH = "bad_finish"
+TOO_MANY_MATTES = "too_many_mattes"
+DUPLICATE_PAINT = "duplicate_paint"
+SINGLE_PAINT_CONFLICT = "single_paint_conflict"
+SINGLE_PAINT_COMPETING = "single_paint_competing"
+# Given by the service for a request body that can't be decoded at all.
+NOT_JSON = "not_json"
+
+REASONS = (NOT_AN_OBJECT, BAD_COUNTS, TOO_FEW_COLORS, CUSTOMER_MISMATCH, TOO_MANY_PAINTS,
+           MALFORMED_CUSTOMER, COLOR_OUT_OF_RANGE, BAD_FINISH, TOO_MANY_MATTES, DUPLICATE_PAINT,
+           SINGLE_PAINT_CONFLICT, SINGLE_PAINT_COMPETING, NOT_JSON)
+
+
+def prevalidate(problem, max_colors=2000, max_customers=2000, max_paints=3000):
+    """
+    :param problem: A decoded {colors, customers, demands} problem.
+    :return: The reason code the problem is rejected for, or None.
+    """
+    if not isinstance(problem, dict):
+        return NOT_AN_OBJECT
+    colors = problem.get("colors")
+    customers = problem.get("customers")
+    demands = problem.get("demands")
+
+    if not isinstance(colors, int) or not isinstance(customers, int) or \
+            isinstance(colors, bool) or isinstance(customers, bool) or \
+            not 1 <= colors <= max_colors or not 1 <= customers <= max_customers:
+        return BAD_COUNTS
+    if colors < customers:
+        # We can only have one batch per color. Too many customers.
+        return TOO_FEW_COLORS
+
+    if hasattr(demands, "offsets"):
+        # Packed requests have no per-customer structure to walk.
+        if demands.customers != customers:
+            return CUSTOMER_MISMATCH
+        if len(demands) > max_paints:
+            return TOO_MANY_PAINTS
+        return None
+
+    if not isinstance(demands, list) or len(demands) != customers:
+        return CUSTOMER_MISMATCH
+
+    paints = 0
+    # Paints requested in total, and by customers who like nothing else.
+    n_total = {}
+    n_single = {}
+    for customer in demands:
+        if not isinstance(customer, list):
+            return MALFORMED_CUSTOMER
+        size = len(customer)
+        paints += size // 2
+        if paints > max_paints:
+            # Stop before looking at anything beyond the limit.
+            return TOO_MANY_PAINTS
+        if size % 2 != 1 or not all(isinstance(i, int) and i >= 0 for i in customer) or \
+                customer[0] != size // 2:
+            return MALFORMED_CUSTOMER
+
+        pairs = list(zip(customer[1::2], customer[::2][1:]))
+        if any(not 1 <= color <= colors for color, _ in pairs):
+            return COLOR_OUT_OF_RANGE
+        if any(finish > 1 for _, finish in pairs):
+            return BAD_FINISH
+        if sum(finish for _, finish in pairs) > 1:
+            return TOO_MANY_MATTES
+        if len(set(pairs)) != len(pairs):
+            return DUPLICATE_PAINT
+
+        for paint in pairs:
+            n_total[paint] = n_total.get(paint, 0) + 1
+        if len(pairs) == 1:
+            color, finish = pairs[0]
+            if (color, 1 - finish) in n_single:
+                # Two customers who each need a different finish of the same color.
+                return SINGLE_PAINT_CONFLICT
+            n_single[pairs[0]] = n_single.get(pairs[0], 0) + 1
+
+    for paint, count in n_single.items():
+        if count > 1 and count == n_total[paint]:
+            # Customers competing for the same paint specification.
+            return SINGLE_PAINT_COMPETING
+    return None
+
+
+def conflicting_customers(demands, reason):
+    """
+    Find two customers who are enough on their own to cause a
+    SINGLE_PAINT_CONFLICT or SINGLE_PAINT_COMPETING rejection.
+
+    :param demands: The demands of the rejected problem.
+    :param reason: The reason prevalidate() gave.
+    :return: The indices of the two customers, or None for other reasons.
+    """
+    if reason not in (SINGLE_PAINT_CONFLICT, SINGLE_PAINT_COMPETING):
+        return None
+    n_total = {}
+    singles = {}
+    for i, customer in enumerate(demands):
+        for paint in zip(customer[1::2], customer[::2][1:]):
+            n_total[paint] = n_total.get(paint, 0) + 1
+        if len(customer) == 3:
+            singles.setdefault((customer[1], customer[2]), []).append(i)
+
+    for (color, finish), custs in sorted(singles.items()):
+        if reason == SINGLE_PAINT_CONFLICT and finish == 0 and (color, 1) in singles:
+            return sorted([custs[0], singles[(color, 1)][0]])
+        if reason == SINGLE_PAINT_COMPETING and len(custs) > 1 and len(custs) == n_total[(color, finish)]:
+            return custs[:2]
+    return None
@@ -0,0 +1,115 @@
+from __future__ import print_function, division
+
+import numpy as np
+
+from collections import deque
+
+
+class Propagate:
+
+    # How many iterations pass between progress reports to a Control.
+    check_every = 1024
+
+    def __init__(self, colors, customers, prefs, control=None):
+        self.colors = colors
+        self.customers = customers
+        self.prefs = prefs
+        self.control = control
+        self.iterations = 0
+        self.mattes = 0
+        self.possible = True
+        self.solution = [0] * self.colors
+
+        # The customer who forced each matte color, the matte colors in the
+        # order they were forced, and the customer left unsatisfied, if any.
+        self.support = {}
+        self.order = []
+        self.violated = None
+        self.matte_of, self.glossy_count = self.get_customer_mapping()
+
+    def get_customer_mapping(self):
+        cust_ids = self.prefs.cust_ids
+        matte = self.prefs.finishes == 1
+
+        # The single matte color each customer likes, if any (-1 otherwise).
+        matte_of = np.full(self.customers, -1, dtype=np.int64)
+        matte_of[cust_ids[matte]] = self.prefs.paint_colors[matte]
+
+        # The number of glossy paints each customer likes.
+        glossy_count = np.bincount(cust_ids[~matte], minlength=self.customers)
+
+        return matte_of.tolist(), glossy_count.tolist()
+
+    def propagate(self):
+        """
+        Start with every color glossy and repeatedly force the matte of any
+        customer left unsatisfied. A color only ever moves from glossy to
+        matte, and each customer is visited once per paint they like, so the
+        work done is linear in the total number of paint preferences.
+
+        :return: Nothing.
+        """
+
+        # Customers who don't like any glossy paint can only be satisfied by a matte.
+        worklist = deque(cust_id for cust_id in range(self.customers)
+                         if self.glossy_count[cust_id] == 0)
+
+        while worklist:
+            cust_id = worklist.popleft()
+            self.iterations += 1
+            if self.control is not None and self.iterations % self.check_every == 0:
+                self.control.check(self.iterations, self.mattes)
+
+            color = self.matte_of[cust_id]
+            if color < 0:
+                # All of this customer's glossy paints went matte and they have no matte.
+                self.possible = False
+                self.violated = cust_id
+                return
+
+            if self.solution[color] == 1:
+                # Already satisfied by an earlier decision.
+                continue
+
+            # This customer forces their matte.
+            self.solution[color] = 1
+            self.mattes += 1
+            self.support[color] = cust_id
+            self.order.append(color)
+
+            custs, finishes = self.prefs.color(color)
+            for other in custs[finishes == 0].tolist():
+                # Everyone who liked this color glossy has lost an option.
+                self.glossy_count[other] -= 1
+                if self.glossy_count[other] == 0:
+                    worklist.append(other)
+
+    def explain(self):
+        """
+        Trace an impossible problem back through the mattes that were forced.
+        The unsatisfied customer only lost their glossy options because other
+        customers forced those colors matte, who were in turn forced by the
+        colors they liked glossy going matte, and so on. These customers
+        can't all be satisfied together, but without any one of them the rest
+        can be.
+
+        :return: The unsatisfied customer, the (customer, color) matte
+                 decisions leading to it in the order they were made, and the
+                 sorted conflicting customers. None if the problem is possible.
+        """
+        if self.possible:
+            return None
+
+        conflict = {self.violated}
+        stack = [self.violated]
+        while stack:
+            colors, finishes = self.prefs.customer(stack.pop())
+            for color in colors[finishes == 0].tolist():
+                # Every glossy color of a forced customer had gone matte.
+                cust_id = self.support[color]
+                if cust_id not in conflict:
+                    conflict.add(cust_id)
+                    stack.append(cust_id)
+
+        chain = [(self.support[color], color) for color in self.order if self.support[color] in conflict]
+        return self.violated, chain, sorted(conflict)
@@ -0,0 +1,198 @@
+from __future__ import print_function, division
+
+from collections import defaultdict
+
+
+class Session:
+    """
+    A problem that is edited one customer at a time. The propagation state
+    (which colors are matte, which customer forced each of them, and how many
+    glossy options each customer has left) is kept between edits and only
+    the part an edit touches is recomputed, so the answer is always the one
+    solver() would give for the current customers.
+
+    Adding a customer can only force more mattes, so it just propagates from
+    the new customer. Removing one retracts the mattes it forced, and
+    everything forced in turn because of them, then re-derives whatever
+    other customers still require.
+
+    Customers are given ids that stay the same as others come and go.
+    Malformed customers and edits are refused with a ValueError.
+    """
+
+    def __init__(self, colors):
+        self.max_paint_combos = 3000
+        self.max_customers = 2000
+        self.max_colors = 2000
+        self.colors = 0
+        self.next_id = 0
+
+        # The customers, as (matte color or -1, glossy colors), by id.
+        self.custs = {}
+
+        # The customers who like each color glossy and matte.
+        self.glossy_custs = defaultdict(set)
+        self.matte_custs = defaultdict(set)
+
+        # How many paints use each color.
+        self.color_use = defaultdict(int)
+        self.paints = 0
+
+        # Paints requested, in total and by customers liking nothing else.
+        self.n_total = defaultdict(int)
+        self.n_single = defaultdict(int)
+        self.competing = 0
+
+        # Propagation state.
+        self.matte = set()
+        self.support = {}
+        self.live = {}
+        self.violated = set()
+        self.iterations = 0
+
+        self.set_colors(colors)
+
+    @classmethod
+    def from_problem(cls, problem):
+        session = cls(problem.get("colors"))
+        for customer in problem.get("demands"):
+            session.add_customer(customer)
+        return session
+
+    @property
+    def customers(self):
+        return len(self.custs)
+
+    def set_colors(self, colors):
+        if not isinstance(colors, int) or not 1 <= colors <= self.max_colors:
+            raise ValueError("Number of colors must be between 1 and %d" % self.max_colors)
+        for color in range(colors, self.colors):
+            if self.color_use[color]:
+                raise ValueError("Color %d is still liked by a customer" % (color + 1))
+        self.colors = colors
+
+    def add_customer(self, customer):
+        """
+        :param customer: A [T, X, Y, X, Y, ...] customer array.
+        :return: The id of the new customer.
+        """
+        matte, glossy = self.parse_customer(customer)
+        if self.customers >= self.max_customers:
+            raise ValueError("Too many customers")
+
+        cust_id = self.next_id
+        self.next_id += 1
+        self.custs[cust_id] = (matte, glossy)
+        self.count_paints(matte, glossy, 1)
+
+        for color in glossy:
+            self.glossy_custs[color].add(cust_id)
+        if matte >= 0:
+            self.matte_custs[matte].add(cust_id)
+        self.live[cust_id] = sum(1 for color in glossy if color not in self.matte)
+
+        self.propagate([cust_id])
+        return cust_id
+
+    def remove_customer(self, cust_id):
+        if cust_id not in self.custs:
+            raise ValueError("No customer %s" % cust_id)
+        matte, glossy = self.custs.pop(cust_id)
+        self.count_paints(matte, glossy, -1)
+
+        for color in glossy:
+            self.glossy_custs[color].discard(cust_id)
+        if matte >= 0:
+            self.matte_custs[matte].discard(cust_id)
+        del self.live[cust_id]
+        self.violated.discard(cust_id)
+
+        if matte >= 0 and self.support.get(matte) == cust_id:
+            self.propagate(self.retract(matte))
+
+    def solution(self):
+        if not self.possible():
+            return "IMPOSSIBLE"
+        return " ".join("1" if color in self.matte else "0" for color in range(self.colors))
+
+    def possible(self):
+        return (1 <= self.customers <= self.colors and self.paints <= self.max_paint_combos
+                and not self.competing and not self.violated)
+
+    def parse_customer(self, customer):
+        # The same per-customer rules Check and Validate apply.
+        if not isinstance(customer, list) or len(customer) % 2 != 1 or \
+                not all(isinstance(i, int) for i in customer) or customer[0] != len(customer) // 2:
+            raise ValueError("Customer must be [T, X, Y, ...] with T pairs of integers")
+        pairs = list(zip(customer[1::2], customer[::2][1:]))
+        if any(not 1 <= color <= self.colors or finish not in (0, 1) for color, finish in pairs):
+            raise ValueError("Colors must be between 1 and %d and finishes 0 or 1" % self.colors)
+        if len(set(pairs)) != len(pairs):
+            raise ValueError("Duplicate paints specified")
+        mattes = [color - 1 for color, finish in pairs if finish]
+        if len(mattes) > 1:
+            raise ValueError("At most one matte per customer")
+        return (mattes[0] if mattes else -1), [color - 1 for color, finish in pairs if not finish]
+
+    def count_paints(self, matte, glossy, sign):
+        paints = [(color, 0) for color in glossy] + ([(matte, 1)] if matte >= 0 else [])
+        self.paints += sign * len(paints)
+        for paint in paints:
+            # Customers who only like one paint can't share it.
+            self.competing -= self.is_competing(paint)
+            self.n_total[paint] += sign
+            self.n_single[paint] += sign * (len(paints) == 1)
+            self.competing += self.is_competing(paint)
+            self.color_use[paint[0]] += sign
+
+    def is_competing(self, paint):
+        return self.n_total[paint] > 1 and self.n_single[paint] == self.n_total[paint]
+
+    def propagate(self, worklist):
+        # Force the matte of every customer left without a glossy option.
+        while worklist:
+            cust_id = worklist.pop()
+            if cust_id not in self.custs or self.live[cust_id]:
+                continue
+            self.iterations += 1
+
+            color = self.custs[cust_id][0]
+            if color < 0:
+                self.violated.add(cust_id)
+                continue
+            if color in self.matte:
+                continue
+
+            self.matte.add(color)
+            self.support[color] = cust_id
+            for other in self.glossy_custs[color]:
+                self.live[other] -= 1
+                if self.live[other] == 0:
+                    worklist.append(other)
+
+    def retract(self, color):
+        """
+        Turn a matte color back to glossy, along with every matte that was
+        forced because of it.
+
+        :param color: The color that has lost its reason to be matte.
+        :return: The customers who may need to force a matte again.
+        """
+        retracted = [color]
+        stack = [color]
+        while stack:
+            color = stack.pop()
+            self.matte.discard(color)
+            del self.support[color]
+            for other in self.glossy_custs[color]:
+                self.live[other] += 1
+                if self.live[other] == 1:
+                    # This customer is satisfied by the glossy again.
+                    self.violated.discard(other)
+                    forced = self.custs[other][0]
+                    if forced >= 0 and self.support.get(forced) == other:
+                        retracted.append(forced)
+                        stack.append(forced)
+
+        return [cust_id for color in retracted for cust_id in self.matte_custs[color]
+                if self.live[cust_id] == 0]
@@ -1,21 +1,112 @@
-from check import Check
-from optimise import Optimise
+import time
 
+# The exhaustive backend imports Check and Optimise (and pandas with them)
+# only when it is used, so the greedy path loads no more than NumPy.
+from backends import BACKENDS, get_backend
+from preferences import Preferences
+from prevalidate import conflicting_customers, prevalidate
+from propagate import Propagate
+from validate import Validate
 
-def solver(problem):
-    colors = problem.get("colors")
-    customers = problem.get("customers")
-    demands = problem.get("demands")
 
-    check = Check(colors, customers, demands)
+def solver(problem, engine="greedy", stats=None, control=None):
+    """
+    :param problem: A {colors, customers, demands} problem. The demands are
+                    either [T, X, Y, X, Y, ...] customer arrays or Preferences
+                    decoded from a packed request.
+    :param engine: The name of a backend in BACKENDS, e.g. "greedy" or "exhaustive".
+    :param stats: Optional dict, see get_results.
+    :param control: Optional Control, see get_results.
+    :return: The solution string, or "IMPOSSIBLE".
+    """
+    backend = get_backend(engine)
+    check = backend.check(problem.get("colors"), problem.get("customers"), problem.get("demands"))
+    return get_results(check, engine, stats, control)
 
-    return get_results(check.check())
 
+def get_results(check, engine="greedy", stats=None, control=None):
+    """
+    Solve a checked problem.
 
-def get_results(check):
-    if check.possible:
-        opt = Optimise(check.colors, check.customers, check.solution, check.nd_arr)
-        opt.iterate_all_combinations()
-        return " ".join(map(str, opt.solution))
-    else:
+    :param check: The result of the backend's check().
+    :param engine: The name of the backend.
+    :param stats: Optional dict, filled in with stage timings, search
+                  iterations, problem sizes and why a problem was impossible.
+    :param control: Optional Control through which the search reports its
+                    progress and can be cancelled (raising Cancelled).
+    :return: The solution string, or "IMPOSSIBLE".
+    """
+    if stats is None:
+        stats = {}
+    stats["engine"] = engine
+    stats["stages"] = dict(check.timings)
+    stats["sizes"] = {"colors": check.colors, "customers": check.customers,
+                      "paints": len(check.prefs) if check.prefs is not None else None}
+
+    if not check.possible:
+        stats["impossible"] = "validation"
+        return "IMPOSSIBLE"
+
+    start = time.time()
+    opt = get_backend(engine).search(check, control)
+    stats["stages"]["optimise"] = time.time() - start
+    stats["iterations"] = opt.iterations
+    if control is not None:
+        # Report where the search finished.
+        control.iterations = opt.iterations
+        if opt.possible:
+            control.best_fitness = int(sum(opt.solution))
+
+    if not opt.possible:
+        stats["impossible"] = "search"
         return "IMPOSSIBLE"
+
+    start = time.time()
+    result = " ".join(map(str, opt.solution))
+    stats["stages"]["format_response"] = time.time() - start
+    return result
+
+
+def explain(problem):
+    """
+    Solve a problem with the greedy engine and, if it is impossible, say why.
+
+    :param problem: A {colors, customers, demands} problem.
+    :return: A dict with the "result". An impossible problem also has a
+             "reason": a prevalidate reason code, "validation" or "search".
+             Where particular customers are to blame, "conflict" lists a
+             minimal set of them (by zero-based index into the demands) that
+             can't all be satisfied. A search conflict also gives the
+             "customer" left unsatisfied and the "chain" of matte decisions
+             that led there, as {customer, color} in the order they were made.
+    """
+    demands = problem.get("demands") if isinstance(problem, dict) else None
+    if isinstance(demands, Preferences) and demands.is_well_formed():
+        # The customer arrays let prevalidate give a more precise reason.
+        problem = dict(problem, demands=demands.to_demands())
+
+    reason = prevalidate(problem)
+    if reason is not None:
+        explanation = {"result": "IMPOSSIBLE", "reason": reason}
+        conflict = conflicting_customers(problem["demands"], reason) if isinstance(problem, dict) else None
+        if conflict is not None:
+            explanation["conflict"] = conflict
+        return explanation
+
+    check = Validate(problem.get("colors"), problem.get("customers"), problem.get("demands")).check()
+    if not check.possible:
+        return {"result": "IMPOSSIBLE", "reason": "validation"}
+
+    opt = Propagate(check.colors, check.customers, check.prefs)
+    opt.propagate()
+    if opt.possible:
+        return {"result": " ".join(map(str, opt.solution))}
+
+    violated, chain, conflict = opt.explain()
+    return {
+        "result": "IMPOSSIBLE",
+        "reason": "search",
+        "customer": violated,
+        "chain": [{"customer": cust_id, "color": color + 1} for cust_id, color in chain],
+        "conflict": conflict,
+    }
@@ -1,14 +1,26 @@
+import os
+import sys
+import subprocess
 import unittest
 
 import numpy as np
 import pandas as pd
 
+import backends
+from bulk import bulk_solve
 from check import Check
-from solver import solver
+from control import BudgetExceeded, Cancelled, Control, DeadlineExceeded
+from preferences import Preferences
+from prevalidate import prevalidate
+import prevalidate as reasons
+from propagate import Propagate
+from session import Session
+from solver import explain, solver
+from validate import Validate
 
 
-def convert_and_call(color, customers, demand):
-    return solver({"colors": color, "customers": customers, "demands": demand})
+def convert_and_call(color, customers, demand, engine="greedy"):
+    return solver({"colors": color, "customers": customers, "demands": demand}, engine=engine)
 
 
 class PaintshopTest(unittest.TestCase):
@@ -113,5 +125,372 @@ class CheckTest(unittest.TestCase):
 
         self.assertEqual(check.df.to_csv(), df.to_csv())
 
+
+class PreferencesTest(unittest.TestCase):
+
+    def test_lookups(self):
+        demand = [[1, 1, 0], [2, 2, 1, 2, 0], [3, 1, 0, 2, 1, 3, 0]]
+        prefs = Preferences.from_demands(3, demand)
+        self.assertEqual(len(prefs), 6)
+        self.assertEqual(prefs.n_paints.tolist(), [1, 2, 3])
+
+        colors, finishes = prefs.customer(1)
+        self.assertEqual(colors.tolist(), [1, 1])
+        self.assertEqual(finishes.tolist(), [1, 0])
+
+        custs, finishes = prefs.color(1)
+        self.assertEqual(custs.tolist(), [1, 1, 2])
+        self.assertEqual(finishes.tolist(), [1, 0, 1])
+        self.assertEqual(prefs.color(2)[0].tolist(), [2])
+
+        self.assertTrue(prefs.likes(2, 2, 0))
+        self.assertFalse(prefs.likes(2, 2, 1))
+
+    def test_packed_round_trip(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 0], [1, 5, 0]]
+        buffer = Preferences.from_demands(5, demand).to_bytes()
+        self.assertEqual(len(buffer), 4 * (3 + 4 + 2 * 4))
+
+        prefs = Preferences.from_bytes(buffer)
+        self.assertEqual((prefs.colors, prefs.customers), (5, 3))
+        self.assertEqual(prefs.to_demands(), demand)
+        self.assertEqual(solver({"colors": 5, "customers": 3, "demands": prefs}), convert_and_call(5, 3, demand))
+        self.assertEqual(solver({"colors": 5, "customers": 3, "demands": prefs}, engine="exhaustive"),
+                         convert_and_call(5, 3, demand))
+
+        with self.assertRaises(ValueError):
+            Preferences.from_bytes(buffer[:-4])
+
+    def test_packed_validation(self):
+        self.assertEqual(Validate(2, 1, Preferences(2, [0, 1], [0], [1])).check().possible, True)
+        self.assertEqual(Validate(2, 1, Preferences(2, [0, 1], [2], [1])).check().possible, False)
+        self.assertEqual(Validate(2, 1, Preferences(2, [0, 1], [0], [2])).check().possible, False)
+        self.assertEqual(Validate(2, 1, Preferences(2, [0, 2], [0], [1])).check().possible, False)
+        self.assertEqual(Validate(2, 2, Preferences(2, [0, 1], [0], [1])).check().possible, False)
+
+    def test_check_has_no_dense_array(self):
+        check = Check(2000, 1, [[1, 2000, 1]]).check()
+        self.assertEqual(check.possible, True)
+        self.assertEqual(len(check.prefs), 1)
+        self.assertFalse(hasattr(check, 'nd_arr'))
+
+
+class ImportTest(unittest.TestCase):
+
+    # Seconds allowed to import the solver and answer a problem.
+    startup_target = 1.0
+
+    def test_core_without_pandas(self):
+        # Run in a fresh interpreter, as this one has already loaded pandas.
+        code = ("import sys, time; start = time.time(); from solver import solver; "
+                "solver({'colors': 1, 'customers': 1, 'demands': [[1, 1, 1]]}); "
+                "print(time.time() - start, 'pandas' in sys.modules)")
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, pandas_loaded = output.decode().split()
+        self.assertEqual(pandas_loaded, "False")
+        self.assertLess(float(seconds), self.startup_target)
+
+
+class PropagateTest(unittest.TestCase):
+
+    def test_engines_agree(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]
+        self.assertEqual(convert_and_call(3, 3, demand, engine="exhaustive"),
+                         convert_and_call(3, 3, demand, engine="greedy"))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            convert_and_call(1, 1, [[1, 1, 0]], engine="quantum")
+
+    def test_forced_glossy_conflict(self):
+        demand = [[1, 1, 0], [2, 1, 0, 2, 1], [2, 2, 0, 1, 1]]
+        prop = Propagate(2, 3, Preferences.from_demands(2, demand))
+        prop.propagate()
+        self.assertEqual(prop.possible, True)
+        self.assertEqual(prop.solution, [0, 0])
+
+        demand = [[1, 2, 0], [1, 1, 1], [2, 1, 0, 2, 1]]
+        prop = Propagate(2, 3, Preferences.from_demands(2, demand))
+        prop.propagate()
+        self.assertEqual(prop.possible, False)
+
+    def test_stats(self):
+        stats = {}
+        solver({"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]},
+               stats=stats)
+        self.assertEqual(stats["iterations"], 3)
+        self.assertEqual(stats["sizes"], {"colors": 3, "customers": 3, "paints": 6})
+        self.assertIn("check_paints", stats["stages"])
+        self.assertIn("optimise", stats["stages"])
+        self.assertNotIn("impossible", stats)
+
+        stats = {}
+        solver({"colors": 1, "customers": 2, "demands": [[1, 1, 0], [1, 1, 1]]}, engine="exhaustive", stats=stats)
+        self.assertEqual(stats["impossible"], "validation")
+        self.assertEqual(list(stats["stages"]), ["check_input"])
+
+    def test_long_chain(self):
+        # Each customer's glossy option is taken away by the previous one.
+        colors = 1000
+        demand = [[1, 1, 1]] + [[2, i, 0, i + 1, 1] for i in range(1, colors)]
+        self.assertEqual(convert_and_call(colors, colors, demand), " ".join(["1"] * colors))
+
+
+class ControlTest(unittest.TestCase):
+
+    problem = {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]}
+
+    def test_progress(self):
+        for engine in ("greedy", "exhaustive"):
+            control = Control()
+            self.assertEqual(solver(self.problem, engine, control=control), "1 1 1")
+            self.assertGreater(control.iterations, 0)
+            self.assertEqual(control.best_fitness, 3)
+
+    def test_cancel(self):
+        control = Control()
+        control.cancel()
+        with self.assertRaises(Cancelled):
+            solver(self.problem, "exhaustive", control=control)
+
+    def test_deadline(self):
+        control = Control(deadline=1e-9)
+        with self.assertRaises(DeadlineExceeded):
+            solver(self.problem, "exhaustive", control=control)
+
+    def test_cpu_budget(self):
+        control = Control(cpu_budget=1e-9)
+        with self.assertRaises(BudgetExceeded):
+            solver(self.problem, "exhaustive", control=control)
+
+
+class BackendsTest(unittest.TestCase):
+
+    def test_exhaustive_impossible(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [2, 2, 0, 3, 1], [2, 3, 0, 1, 0], [1, 4, 0]]
+        for engine in backends.BACKENDS:
+            self.assertEqual(convert_and_call(5, 5, demand, engine), "IMPOSSIBLE")
+
+    def test_exhaustive_minimum_matte(self):
+        # Each matte forces the next, until color 4 can stay glossy.
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [2, 2, 0, 3, 1], [2, 3, 0, 4, 0]]
+        for engine in backends.BACKENDS:
+            self.assertEqual(convert_and_call(4, 4, demand, engine), "1 1 1 0")
+
+    def test_customer_without_paints(self):
+        # A customer who likes nothing (T = 0) can't be satisfied, wherever they come.
+        for demand in ([[1, 1, 0], [0]], [[0], [1, 1, 0]]):
+            for engine in backends.BACKENDS:
+                self.assertEqual(convert_and_call(2, 2, demand, engine), "IMPOSSIBLE")
+
+    def test_register(self):
+        @backends.register
+        class AllMatte(backends.Greedy):
+            name = "all_matte"
+
+            def search(self, check, control=None):
+                opt = backends.Greedy.search(self, check, control)
+                opt.solution = [1] * check.colors
+                return opt
+
+        try:
+            self.assertEqual(convert_and_call(2, 1, [[1, 1, 0]], "all_matte"), "1 1")
+        finally:
+            del backends.BACKENDS["all_matte"]
+
+    def test_estimate(self):
+        for engine in backends.BACKENDS:
+            backend = backends.get_backend(engine)
+            small = backend.estimate(5, 5, 10)
+            large = backend.estimate(2000, 2000, 3000)
+            self.assertTrue(all(0 < a < b for a, b in zip(small, large)))
+        # Exhaustive search is exponential in the number of colors.
+        self.assertGreater(backends.get_backend("exhaustive").estimate(60, 5, 10)[0], 3600)
+        # Check's memory grows with the paints, not with N * M.
+        self.assertEqual(backends.get_backend("exhaustive").estimate(2000, 2000, 10)[1],
+                         backends.get_backend("exhaustive").estimate(10, 10, 10)[1])
+
+
+class BulkTest(unittest.TestCase):
+
+    def test_matches_solver(self):
+        problems = [
+            {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]},
+            {"colors": 5, "customers": 5, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [2, 2, 0, 3, 1],
+                                                      [2, 3, 0, 1, 0], [1, 4, 0]]},
+            {"colors": 5, "customers": 2, "demands": [[1, 5, 1], [2, 1, 0, 2, 1]]},
+            {"colors": 1, "customers": 2, "demands": [[1, 1, 0], [1, 1, 1]]},
+            {"colors": 3, "customers": 2, "demands": [[1, 2, 1], [1, 2, 1]]},
+            {"colors": 2, "customers": 1, "demands": [[2, 1, 1, 2, 1]]},
+            {"colors": 2, "customers": 1, "demands": [[2, 1, 0, 1, 0]]},
+            {"colors": 1, "customers": 1, "demands": [[1, 1, 0.5]]},
+            {"colors": 1, "customers": 1, "demands": [[2, 1, 0]]},
+            {"colors": "1", "customers": 1, "demands": [[1, 1, 0]]},
+            {"colors": True, "customers": 1, "demands": [[1, 1, 0]]},
+            {"colors": 2, "customers": 2, "demands": [[1, 1, 0], [2, 1, 1, 2, 0]]},
+        ]
+        expected = [solver(problem) for problem in problems]
+        self.assertEqual(bulk_solve(problems), expected)
+        # A malformed problem doesn't affect the others.
+        self.assertEqual(bulk_solve(problems[:1] + [[1, 2]] + problems[-1:]),
+                         [expected[0], "IMPOSSIBLE", expected[-1]])
+        self.assertEqual(bulk_solve([]), [])
+
+    def test_packed(self):
+        demands = [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]
+        prefs = Preferences.from_demands(3, demands)
+        # Offsets that don't delimit the paints.
+        broken = Preferences(3, np.array([0, 2, 1, 6]), prefs.paint_colors, prefs.finishes)
+        problems = [{"colors": 3, "customers": 3, "demands": prefs},
+                    {"colors": 3, "customers": 3, "demands": broken},
+                    {"colors": 3, "customers": 3, "demands": demands}]
+        self.assertEqual(bulk_solve(problems), ["1 1 1", "IMPOSSIBLE", "1 1 1"])
+
+
+class ExplainTest(unittest.TestCase):
+
+    def test_search_conflict(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [2, 2, 0, 3, 1], [2, 3, 0, 1, 0], [1, 4, 0]]
+        explanation = explain({"colors": 5, "customers": 5, "demands": demand})
+        self.assertEqual(explanation["reason"], "search")
+        self.assertEqual(explanation["customer"], 3)
+        self.assertEqual(explanation["chain"], [{"customer": 0, "color": 1}, {"customer": 1, "color": 2},
+                                                {"customer": 2, "color": 3}])
+        self.assertEqual(explanation["conflict"], [0, 1, 2, 3])
+
+        # Every customer in the conflict is needed for it.
+        for i in explanation["conflict"]:
+            rest = [demand[j] for j in explanation["conflict"] if j != i]
+            self.assertNotEqual(convert_and_call(5, len(rest), rest), "IMPOSSIBLE")
+
+    def test_rejected(self):
+        explanation = explain({"colors": 3, "customers": 3, "demands": [[1, 3, 0], [1, 1, 1], [1, 1, 1]]})
+        self.assertEqual(explanation, {"result": "IMPOSSIBLE", "reason": reasons.SINGLE_PAINT_COMPETING,
+                                       "conflict": [1, 2]})
+        explanation = explain({"colors": 1, "customers": 2, "demands": [[1, 1, 0], [1, 1, 1]]})
+        self.assertEqual(explanation, {"result": "IMPOSSIBLE", "reason": reasons.TOO_FEW_COLORS})
+
+    def test_possible(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]
+        self.assertEqual(explain({"colors": 3, "customers": 3, "demands": demand}), {"result": "1 1 1"})
+
+
+class ValidateTest(unittest.TestCase):
+
+    def assertSameAsCheck(self, colors, customers, demand):
+        check = Check(colors, customers, demand).check()
+        validate = Validate(colors, customers, demand).check()
+        self.assertEqual(validate.possible, check.possible)
+        if check.possible:
+            np.testing.assert_array_equal(validate.solution, check.solution)
+
+    def test_matches_check(self):
+        self.assertSameAsCheck(5, 3, [[1, 1, 1], [2, 1, 0, 2, 0], [1, 5, 0]])
+        self.assertSameAsCheck(3, 3, [[1, 1, 0], [2, 1, 1, 2, 0], [3, 2, 1, 3, 0, 3, 1]])
+        self.assertSameAsCheck(3, 2, [[1, 2, 0], [1, 2, 1]])
+        self.assertSameAsCheck(3, 2, [[1, 2, 1], [1, 2, 1]])
+        self.assertSameAsCheck(3, 2, [[2, 2, 1, 2, 1], [1, 1, 0]])
+        self.assertSameAsCheck(3, 2, [[1, 2, 1], [2, 2, 1, 1, 0]])
+
+    def test_malformed_customers(self):
+        for demand in ([[1, 1]], [[1, 1, 0.5]], [[1, 1, "0"]], [[1, [1], 0]], [1], [[1, 0, 0]]):
+            self.assertEqual(Validate(1, 1, demand).check().possible, False)
+
+    def test_malformed_input(self):
+        self.assertEqual(Validate("1", 1, [[1, 1, 0]]).check().possible, False)
+        self.assertEqual(Validate(1, 1, None).check().possible, False)
+        self.assertEqual(Validate(True, 1, [[1, 1, 0]]).check().possible, False)
+        self.assertEqual(Validate(2, True, [[1, 1, 0]]).check().possible, False)
+
+    def test_too_many_paint_choices(self):
+        demand = [[1, 1, 0], [2, 1, 1, 2, 0], [3, 2, 1, 3, 0, 3, 1]]
+        validate = Validate(3, 3, demand)
+        validate.max_paint_combos = 5
+        self.assertEqual(validate.check().possible, False)
+
+
+class PrevalidateTest(unittest.TestCase):
+
+    def assertRejected(self, reason, colors, customers, demand):
+        problem = {"colors": colors, "customers": customers, "demands": demand}
+        self.assertEqual(prevalidate(problem), reason)
+        self.assertEqual(solver(problem), "IMPOSSIBLE")
+
+    def test_reasons(self):
+        self.assertRejected(reasons.BAD_COUNTS, "1", 1, [[1, 1, 0]])
+        self.assertRejected(reasons.BAD_COUNTS, True, 1, [[1, 1, 0]])
+        self.assertRejected(reasons.BAD_COUNTS, 2, True, [[1, 1, 0]])
+        self.assertRejected(reasons.TOO_FEW_COLORS, 1, 2, [[1, 1, 0], [1, 1, 0]])
+        self.assertRejected(reasons.CUSTOMER_MISMATCH, 2, 2, [[1, 1, 0]])
+        self.assertRejected(reasons.MALFORMED_CUSTOMER, 1, 1, [[1, 1, 0.5]])
+        self.assertRejected(reasons.COLOR_OUT_OF_RANGE, 1, 1, [[1, 2, 0]])
+        self.assertRejected(reasons.BAD_FINISH, 1, 1, [[1, 1, 2]])
+        self.assertRejected(reasons.TOO_MANY_MATTES, 2, 1, [[2, 1, 1, 2, 1]])
+        self.assertRejected(reasons.DUPLICATE_PAINT, 2, 1, [[2, 1, 0, 1, 0]])
+        self.assertRejected(reasons.SINGLE_PAINT_CONFLICT, 3, 2, [[1, 2, 0], [1, 2, 1]])
+        self.assertRejected(reasons.SINGLE_PAINT_COMPETING, 3, 2, [[1, 2, 1], [1, 2, 1]])
+        self.assertEqual(prevalidate([1, 2]), reasons.NOT_AN_OBJECT)
+
+    def test_stops_at_paint_limit(self):
+        # Customers past the limit aren't looked at.
+        customer = [1600] + [i for color in range(1, 1601) for i in (color, 0)]
+        demand = [customer, customer, "garbage"]
+        self.assertEqual(prevalidate({"colors": 2000, "customers": 3, "demands": demand}),
+                         reasons.TOO_MANY_PAINTS)
+
+    def test_accepts_solvable(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]
+        self.assertIsNone(prevalidate({"colors": 3, "customers": 3, "demands": demand}))
+        # Single-pair customers can share a paint someone else also likes.
+        demand = [[1, 1, 1], [1, 1, 1], [2, 1, 1, 2, 0]]
+        self.assertIsNone(prevalidate({"colors": 3, "customers": 3, "demands": demand}))
+        self.assertEqual(convert_and_call(3, 3, demand), "1 0 0")
+
+
+class SessionTest(unittest.TestCase):
+
+    def test_matches_solver(self):
+        demand = [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]
+        session = Session(3)
+        ids = [session.add_customer(customer) for customer in demand]
+        self.assertEqual(session.solution(), convert_and_call(3, 3, demand))
+
+        # Dropping the first customer unwinds the whole chain of mattes.
+        session.remove_customer(ids[0])
+        self.assertEqual(session.solution(), convert_and_call(3, 2, demand[1:]))
+        self.assertEqual(session.solution(), "0 0 0")
+
+        session.add_customer([1, 1, 1])
+        self.assertEqual(session.solution(), "1 1 1")
+
+    def test_impossible_until_removed(self):
+        session = Session.from_problem({"colors": 2, "customers": 2, "demands": [[1, 1, 0], [2, 1, 1, 2, 0]]})
+        self.assertEqual(session.solution(), "0 0")
+        blocker = session.add_customer([1, 2, 1])
+        self.assertEqual(session.solution(), "IMPOSSIBLE")
+        session.remove_customer(blocker)
+        self.assertEqual(session.solution(), "0 0")
+
+    def test_validation(self):
+        session = Session(2)
+        self.assertEqual(session.solution(), "IMPOSSIBLE")
+        session.add_customer([1, 2, 1])
+        with self.assertRaises(ValueError):
+            session.add_customer([2, 1, 1, 2, 1])
+        with self.assertRaises(ValueError):
+            session.add_customer([1, 3, 0])
+        with self.assertRaises(ValueError):
+            session.set_colors(1)
+        session.set_colors(3)
+        self.assertEqual(session.solution(), "0 1 0")
+
+        # Two customers who only like the same paint.
+        competitor = session.add_customer([1, 2, 1])
+        self.assertEqual(session.solution(), "IMPOSSIBLE")
+        session.remove_customer(competitor)
+        self.assertEqual(session.solution(), "0 1 0")
+
+
 if __name__ == "__main__":
      unittest.main()
@@ -0,0 +1,182 @@
+import time
+
+import numpy as np
+
+from preferences import Preferences
+
+
+class Validate:
+    """
+    Array-backed equivalent of Check. The request is flattened once into
+    integer arrays and every rule is then applied to whole arrays at once,
+    without building a DataFrame or the dense customer/color/finish cube.
+
+    The request may also be given as Preferences already, e.g. decoded from
+    a packed request, in which case its arrays are checked directly.
+    """
+
+    def __init__(self, colors, customers, request):
+        self.colors = colors
+        self.customers = customers
+        self.request = request
+        self.possible = True
+        self.solution = None
+        self.values = None
+        self.lengths = None
+        self.prefs = None
+        self.timings = {}
+        self.max_paint_combos = 3000
+        self.max_customers = 2000
+        self.max_colors = 2000
+
+    def check(self):
+        if isinstance(self.request, Preferences):
+            calls = [self.check_input, self.check_arrays, self.check_paints, self.check_limits]
+        else:
+            calls = [self.check_input, self.ingest, self.check_customers,
+                     self.convert_request_to_arrays, self.check_paints, self.check_limits]
+        for method in calls:
+            # We only need to do subsequent checks if things are not impossible thus far.
+            if self.possible:
+                start = time.time()
+                method()
+                self.timings[method.__name__] = time.time() - start
+        return self
+
+    def check_input(self):
+        if not isinstance(self.colors, int) or not isinstance(self.customers, int) or \
+                isinstance(self.colors, bool) or isinstance(self.customers, bool):
+            # Specified numbers of colors and customers must be integers (and
+            # JSON true and false are not).
+            self.possible = False
+        elif not 1 <= self.colors <= self.max_colors:
+            # Number of colors must be within specified bounds.
+            self.possible = False
+        elif not 1 <= self.customers <= self.max_customers:
+            # Number of customers must be within specified bounds.
+            self.possible = False
+        elif self.requested_customers() != self.customers:
+            # Number of customers must be correctly specified.
+            self.possible = False
+        elif self.colors < self.customers:
+            # We can only have one batch per color. Too many customers.
+            self.possible = False
+
+    def requested_customers(self):
+        if isinstance(self.request, Preferences):
+            return self.request.customers
+        if isinstance(self.request, list):
+            return len(self.request)
+        return None
+
+    def ingest(self):
+        # Flatten every customer array into a single pass over the request.
+        flat = []
+        lengths = []
+        for customer in self.request:
+            if not isinstance(customer, list):
+                self.possible = False
+                return
+            flat.extend(customer)
+            lengths.append(len(customer))
+
+        try:
+            self.values = np.array(flat)
+        except (ValueError, TypeError):
+            # Nested or otherwise ragged customer arrays.
+            self.possible = False
+            return
+        self.lengths = np.array(lengths, dtype=np.int64)
+
+        if self.values.dtype.kind not in 'biu':
+            # Must be all integer values.
+            self.possible = False
+        else:
+            self.values = self.values.astype(np.int64)
+
+    def check_customers(self):
+        lengths = self.lengths
+        if np.any(lengths % 2 != 1):
+            # Ensure length of every customer array is correct.
+            self.possible = False
+            return
+        values = self.values
+        if np.any(values < 0):
+            # Must be positive integers.
+            self.possible = False
+            return
+
+        starts = np.cumsum(lengths) - lengths
+        if np.any(values[starts] != (lengths - 1) // 2):
+            # T must be correctly specified.
+            self.possible = False
+            return
+
+        position = np.arange(len(values)) - np.repeat(starts, lengths)
+        paint_colors = values[position % 2 == 1]
+        finishes = values[(position > 0) & (position % 2 == 0)]
+        if np.any(paint_colors < 1) or np.any(paint_colors > self.colors):
+            # Specified colors must be within permissible range.
+            self.possible = False
+        if np.any(finishes > 1):
+            # Paint finishes must be binary.
+            self.possible = False
+
+    def check_arrays(self):
+        prefs = self.request
+        if not prefs.is_well_formed():
+            # Offsets must delimit every paint, in order.
+            self.possible = False
+        elif np.any(prefs.paint_colors < 0) or np.any(prefs.paint_colors >= self.colors):
+            # Specified colors must be within permissible range.
+            self.possible = False
+        elif np.any((prefs.finishes != 0) & (prefs.finishes != 1)):
+            # Paint finishes must be binary.
+            self.possible = False
+        else:
+            self.prefs = prefs
+
+    def convert_request_to_arrays(self):
+        self.prefs = Preferences.from_flat(self.colors, self.values, self.lengths)
+
+    def check_paints(self):
+        prefs = self.prefs
+        cust_ids = prefs.cust_ids
+        paint_colors = prefs.paint_colors.astype(np.int64)
+        finishes = prefs.finishes.astype(np.int64)
+        self.solution = np.full(self.colors, np.nan)
+
+        if np.any(np.bincount(cust_ids, weights=finishes, minlength=self.customers) > 1):
+            # Too many matte finishes per customer specified.
+            self.possible = False
+
+        keys = (cust_ids * self.colors + paint_colors) * 2 + finishes
+        if np.unique(keys).size != keys.size:
+            # Duplicate entries of color and finish specified.
+            self.possible = False
+
+        # Count requests for each paint, and those from customers who like nothing else.
+        paints = paint_colors * 2 + finishes
+        single = (prefs.n_paints == 1)[cust_ids]
+        n_total = np.bincount(paints, minlength=2 * self.colors)
+        n_single = np.bincount(paints[single], minlength=2 * self.colors)
+        only_single = (n_total > 0) & (n_single == n_total)
+
+        if np.any(only_single & (n_total > 1)):
+            # We have customers competing for the same paint specifications.
+            self.possible = False
+
+        # Customers who only requested one paint, and who are the only ones requesting
+        # that paint. These paints must be completed in this finish.
+        forced = (only_single & (n_total == 1)).reshape(self.colors, 2)
+        self.solution[forced[:, 0]] = 0
+        self.solution[forced[:, 1]] = 1
+
+    def check_limits(self):
+        # The total number of paint choices must be less than 3000.
+        if len(self.prefs) > self.max_paint_combos:
+            self.possible = False
+
+        # Find unliked paint colors and set these to 0 in base solution.
+        unliked = np.bincount(self.prefs.paint_colors, minlength=self.colors) == 0
+        self.solution[unliked] = 0
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+#usage: ./store.py check DIR | ./store.py compact DIR
+"""
+A permanent record of every problem solved and its solution, so that a
+problem solved once is never solved again, even by a freshly started node.
+
+The data file is append-only. Each record holds the problem's key (the
+SHA-256 of its canonical JSON), that JSON, the result and a CRC of both.
+The index file is an open addressing hash table of (key, offset) slots,
+memory-mapped so that a lookup reads one or two slots and then the record
+itself, however many records there are, and opening a store costs nothing.
+It can always be rebuilt from the data file.
+
+Several processes can share a store: writers take a lock file, and the
+index is mapped shared, so entries one process adds are seen by the others
+straight away. When the index fills up it is replaced by one twice the
+size, which the other processes pick up the next time they miss.
+
+Run as a script, `check` verifies every record and the index against the
+data, and `compact` rewrites the store without damaged or superseded
+records, rebuilding the index.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import sys
+import mmap
+import zlib
+import struct
+import hashlib
+import argparse
+import binascii
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cache import cache_hits, canonical_problem
+
+DATA_MAGIC = b'PSDATA1\n'
+INDEX_MAGIC = b'PSINDEX1'
+# Key, problem length, result length and CRC-32 of the problem and result.
+RECORD = struct.Struct('<32sIII')
+# Magic, number of slots, number of entries and bytes of data indexed.
+HEADER = struct.Struct('<8sQQQ')
+# Key and data offset + 1, so that an empty slot is all zeroes.
+SLOT = struct.Struct('<32sQ')
+MIN_SLOTS = 1 << 12
+MAX_LOAD = 0.6
+
+
+class StoreError(Exception):
+    pass
+
+
+def read_records(data, start=len(DATA_MAGIC)):
+    """
+    Read a data file's records in order, stopping at the first that isn't
+    complete (a write cut short).
+
+    :param data: The open data file.
+    :param start: The offset to start from.
+    :return: A generator of (offset, key, problem, result, crc ok) tuples.
+    """
+    data.seek(start)
+    offset = start
+    while True:
+        header = data.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return
+        key, n_problem, n_result, crc = RECORD.unpack(header)
+        body = data.read(n_problem + n_result)
+        if len(body) < n_problem + n_result:
+            return
+        yield offset, key, body[:n_problem], body[n_problem:], zlib.crc32(body) & 0xffffffff == crc
+        offset += RECORD.size + len(body)
+
+
+class Index:
+    """
+    The memory-mapped hash table. Slots are found by linear probing from the
+    key's first eight bytes; entries are never removed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.slots, _, _ = HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC or len(self.map) != HEADER.size + self.slots * SLOT.size:
+            self.close()
+            raise StoreError("%s is not a solution index" % path)
+
+    @classmethod
+    def create(cls, path, slots):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(INDEX_MAGIC, slots, 0, len(DATA_MAGIC)))
+            f.truncate(HEADER.size + slots * SLOT.size)
+        os.rename(tmp, path)
+        return cls(path)
+
+    @property
+    def count(self):
+        return HEADER.unpack_from(self.map)[2]
+
+    @property
+    def covered(self):
+        return HEADER.unpack_from(self.map)[3]
+
+    def set_header(self, count, covered):
+        HEADER.pack_into(self.map, 0, INDEX_MAGIC, self.slots, count, covered)
+
+    def is_current(self):
+        # Whether the file mapped is still the one at the path.
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self.file.fileno()).st_ino
+        except OSError:
+            return False
+
+    def probe(self, key):
+        slot = struct.unpack_from('<Q', key)[0] % self.slots
+        while True:
+            position = HEADER.size + slot * SLOT.size
+            found, offset = SLOT.unpack_from(self.map, position)
+            if offset == 0 or found == key:
+                return position, offset - 1
+            slot = (slot + 1) % self.slots
+
+    def get(self, key):
+        """
+        :return: The offset of the key's record, or -1.
+        """
+        return self.probe(key)[1]
+
+    def add(self, key, offset):
+        position, found = self.probe(key)
+        if found >= 0:
+            return False
+        # The offset goes in before the key, so a reader never sees a key without one.
+        self.map[position + 32:position + SLOT.size] = struct.pack('<Q', offset + 1)
+        self.map[position:position + 32] = key
+        return True
+
+    def entries(self):
+        for slot in range(self.slots):
+            key, offset = SLOT.unpack_from(self.map, HEADER.size + slot * SLOT.size)
+            if offset:
+                yield key, offset - 1
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class SolutionStore:
+    """
+    Solutions keyed by problem_key, kept in a directory, for good.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.data_path = os.path.join(directory, 'solutions.dat')
+        self.index_path = os.path.join(directory, 'solutions.idx')
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(directory, 'solutions.lock'), 'a')
+
+        with self._locked():
+            if not os.path.exists(self.data_path):
+                with open(self.data_path, 'wb') as f:
+                    f.write(DATA_MAGIC)
+            self.data = open(self.data_path, 'r+b')
+            if self.data.read(len(DATA_MAGIC)) != DATA_MAGIC:
+                raise StoreError("%s is not a solution store" % self.data_path)
+            try:
+                self.index = Index(self.index_path)
+            except (IOError, OSError, StoreError, ValueError):
+                self.index = Index.create(self.index_path, MIN_SLOTS)
+            self._catch_up()
+
+    def _locked(self):
+        return _FileLock(self._lock, self._lock_file)
+
+    def _catch_up(self):
+        # Index records appended since the index was last written, as after a
+        # crash or with a rebuilt index, and drop any record cut short.
+        end = self.index.covered
+        count = self.index.count
+        for offset, key, problem, result, ok in read_records(self.data, end):
+            end = offset + RECORD.size + len(problem) + len(result)
+            if ok:
+                self._grow(count + 1)
+                count += self.index.add(key, offset)
+        self.data.seek(0, os.SEEK_END)
+        if self.data.tell() > end:
+            self.data.truncate(end)
+        self.index.set_header(count, end)
+
+    def _grow(self, count):
+        if count <= MAX_LOAD * self.index.slots:
+            return
+        slots = self.index.slots
+        while count > MAX_LOAD * slots:
+            slots *= 2
+        old = self.index
+        new = Index.create(self.index_path + '.new', slots)
+        for key, offset in old.entries():
+            new.add(key, offset)
+        new.set_header(old.count, old.covered)
+        new.close()
+        os.rename(self.index_path + '.new', self.index_path)
+        self.index = Index(self.index_path)
+        old.close()
+
+    def _refresh(self):
+        # Another process replaced the index; map the new one.
+        if not self.index.is_current():
+            old = self.index
+            self.index = Index(self.index_path)
+            old.close()
+            return True
+        return False
+
+    def get(self, key):
+        """
+        :param key: A problem_key.
+        :return: The result stored for the problem, or None.
+        """
+        digest = binascii.unhexlify(key)
+        with self._lock:
+            offset = self.index.get(digest)
+            if offset < 0 and self._refresh():
+                offset = self.index.get(digest)
+            if offset < 0:
+                return None
+            self.data.seek(offset)
+            found, n_problem, n_result, _ = RECORD.unpack(self.data.read(RECORD.size))
+            if found != digest:
+                return None
+            self.data.seek(n_problem, os.SEEK_CUR)
+            result = self.data.read(n_result).decode('utf-8')
+        cache_hits.labels('store').inc()
+        return result
+
+    def put(self, key, problem, result):
+        """
+        Record a solution, unless the problem already has one.
+
+        :param key: The problem's problem_key.
+        :param problem: A {colors, customers, demands} problem.
+        :param result: Its result.
+        """
+        digest = binascii.unhexlify(key)
+        encoded = canonical_problem(problem).encode('utf-8')
+        answer = result.encode('utf-8')
+        with self._locked():
+            self._refresh()
+            # Take in anything other processes have written.
+            self._catch_up()
+            if self.index.get(digest) >= 0:
+                return
+            self.data.seek(0, os.SEEK_END)
+            offset = self.data.tell()
+            self.data.write(RECORD.pack(digest, len(encoded), len(answer),
+                                        zlib.crc32(encoded + answer) & 0xffffffff) + encoded + answer)
+            self.data.flush()
+            self._grow(self.index.count + 1)
+            self.index.add(digest, offset)
+            self.index.set_header(self.index.count + 1, self.data.tell())
+
+    def close(self):
+        self.index.close()
+        self.data.close()
+        self._lock_file.close()
+
+
+class _FileLock:
+    # Holds a thread lock and, where there is flock, the lock file.
+
+    def __init__(self, lock, lock_file):
+        self.lock = lock
+        self.lock_file = lock_file
+
+    def __enter__(self):
+        self.lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+def check(directory):
+    """
+    Verify every record against its CRC and key, and the index against the
+    records.
+
+    :param directory: The store's directory.
+    :return: A list of problems found.
+    """
+    store = SolutionStore(directory)
+    errors = []
+    indexed = {}
+    with store._locked():
+        for offset, key, problem, result, ok in read_records(store.data):
+            if not ok:
+                errors.append("record at %d fails its CRC" % offset)
+            elif hashlib.sha256(problem).digest() != key:
+                errors.append("record at %d is filed under the wrong key" % offset)
+            else:
+                indexed.setdefault(key, offset)
+        for key, offset in indexed.items():
+            if store.index.get(key) != offset:
+                errors.append("index entry for %s is wrong" % binascii.hexlify(key).decode('ascii'))
+        if store.index.count != len(indexed):
+            errors.append("index has %d entries for %d problems" % (store.index.count, len(indexed)))
+    store.close()
+    print("%d problems" % len(indexed))
+    return errors
+
+
+def compact(directory):
+    """
+    Rewrite the store keeping one good record per problem, and rebuild the
+    index. Other processes must not be using the store.
+
+    :param directory: The store's directory.
+    :return: The number of records dropped.
+    """
+    store = SolutionStore(directory)
+    kept = set()
+    dropped = 0
+    tmp = store.data_path + '.compact'
+    with store._locked():
+        with open(tmp, 'wb') as out:
+            out.write(DATA_MAGIC)
+            for offset, key, problem, result, ok in read_records(store.data):
+                if not ok or key in kept or hashlib.sha256(problem).digest() != key:
+                    dropped += 1
+                    continue
+                kept.add(key)
+                out.write(RECORD.pack(key, len(problem), len(result), zlib.crc32(problem + result) & 0xffffffff))
+                out.write(problem + result)
+        os.rename(tmp, store.data_path)
+        os.remove(store.index_path)
+    store.close()
+    # Opening the store again indexes the new data file from scratch.
+    SolutionStore(directory).close()
+    return dropped
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'command',
+        choices=['check', 'compact'],
+        help='check the store, or compact it'
+    )
+    parser.add_argument(
+        'directory',
+        type=str,
+        help='the store directory'
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    if args.command == 'compact':
+        print("%d records dropped" % compact(args.directory))
+        return 0
+    errors = check(args.directory)
+    for error in errors:
+        print(error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,787 @@
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import sys
+import signal
+import json
+import zlib
+import shutil
+import time
+import tempfile
+import threading
+import unittest
+from argparse import Namespace
+from io import StringIO
+
+from prometheus_client import REGISTRY
+
+import app as paintshop
+import cli
+import profiling
+import replay
+from sessions import Sessions
+from cache import ResultCache, canonical_problem, normalise_demands, problem_key
+from jobs import DONE, RUNNING, TIMEOUT, JobQueue
+from admission import Admission
+from pool import SolverOverloaded, SolverPool, SolverTimeout, SolverTooLarge
+import store
+from store import DATA_MAGIC, RECORD, SolutionStore
+from solver.solver import Preferences
+
+
+def make_problem(i):
+    return {"colors": i + 1, "customers": 1, "demands": [[1, i + 1, i % 2]]}
+
+
+def encode_record(problem, result):
+    # A record as SolutionStore.put writes it.
+    encoded = canonical_problem(problem).encode('utf-8')
+    answer = result.encode('utf-8')
+    digest = bytes(bytearray.fromhex(problem_key(problem)))
+    return RECORD.pack(digest, len(encoded), len(answer), zlib.crc32(encoded + answer) & 0xffffffff) + \
+        encoded + answer
+
+
+class ParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = paintshop.app.test_client()
+
+    def rejections(self):
+        return REGISTRY.get_sample_value('prevalidation_rejections_total', {'reason': 'not_json'}) or 0
+
+    def test_problem(self):
+        response = self.client.post('/v1/', data='{"colors": 1, "customers": 1, "demands": [[1, 1, 1]]}')
+        self.assertEqual((response.status_code, response.data), (200, b"1"))
+        response = self.client.get('/v1/?input={"colors": 1, "customers": 1, "demands": [[1, 1, 0]]}')
+        self.assertEqual((response.status_code, response.data), (200, b"0"))
+
+    def test_not_json(self):
+        before = self.rejections()
+        self.assertEqual(self.client.post('/v1/', data='{"colors": 1,').status_code, 400)
+        self.assertEqual(self.client.post('/v1/', data=b'\xff\xfe').status_code, 400)
+        self.assertEqual(self.client.get('/v1/?input=colors').status_code, 400)
+        self.assertEqual(self.client.get('/v1/').status_code, 400)
+        self.assertEqual(self.client.post('/v2/jobs', data='[1, 2').status_code, 400)
+        self.assertEqual(self.rejections(), before + 5)
+
+    def test_too_large(self):
+        body = '{"colors": 1, "customers": 1, "demands": [[1, 1, 1]]}' + ' ' * paintshop.MAX_PROBLEM_BYTES
+        self.assertEqual(self.client.post('/v1/', data=body).status_code, 413)
+        body = Preferences.from_demands(1, [[1, 1, 1]]).to_bytes() + b'\0' * paintshop.MAX_PROBLEM_BYTES
+        self.assertEqual(self.client.post('/v1/', data=body, content_type='application/octet-stream').status_code,
+                         413)
+
+
+class CountingAdmission(Admission):
+
+    def __init__(self, *args):
+        Admission.__init__(self, *args)
+        self.admitted = 0
+
+    def admit(self, problem, engine):
+        cost = Admission.admit(self, problem, engine)
+        self.admitted += 1
+        return cost
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_waits_for_room(self):
+        admission = Admission(capacity=1.0, wait=5.0)
+        cost = admission.admit(slow_problem(30), "exhaustive")
+        admitted = []
+        thread = threading.Thread(target=lambda: admitted.append(admission.admit(slow_problem(30), "exhaustive")))
+        thread.start()
+        thread.join(0.2)
+        self.assertEqual(admitted, [])
+        admission.release(cost)
+        thread.join()
+        self.assertEqual(len(admitted), 1)
+        self.assertEqual(admission.running, 1)
+
+    def test_overloaded(self):
+        admission = Admission(capacity=1.0, wait=0.1, cpu_budget=0.9)
+        admission.admit(slow_problem(30), "exhaustive")
+        start = time.time()
+        with self.assertRaises(SolverOverloaded):
+            admission.admit(slow_problem(30), "exhaustive")
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        # Small solves still fit in the room left.
+        self.assertLess(admission.admit(make_problem(0), "greedy"), 1.0)
+
+    def test_too_large(self):
+        config = dict(paintshop.app.config)
+        paintshop.app.config['pool'] = SolverPool(admission=Admission(max_memory=1000))
+        try:
+            response = paintshop.app.test_client().post('/v1/', data=json.dumps(CoalesceTest.problem))
+        finally:
+            paintshop.app.config.update(config)
+        self.assertEqual((response.status_code, response.data), (413, b"TOO_LARGE"))
+        with self.assertRaises(SolverTooLarge):
+            Admission(max_memory=1000).admit(CoalesceTest.problem, "greedy")
+
+    def test_released(self):
+        admission = Admission(capacity=10.0, cpu_budget=2.0)
+        pool = SolverPool(admission=admission)
+        self.assertEqual(pool.solve(CoalesceTest.problem, "exhaustive"), "1 1 1")
+        self.assertEqual((admission.running, admission.load), (0, 0.0))
+        with self.assertRaises(SolverTimeout):
+            pool.solve(slow_problem(30), "exhaustive")
+        self.assertEqual((admission.running, admission.load), (0, 0.0))
+
+    def test_retry_admitted(self):
+        admission = CountingAdmission(100.0, 1.0)
+        pool = SolverPool(1, admission=admission, cache=ResultCache())
+        try:
+            executor = pool._executor
+            job = pool.submit(slow_problem(14), "exhaustive")
+            follower = pool.submit(slow_problem(14), "exhaustive")
+            time.sleep(0.2)
+            for process in list(executor._processes.values()):
+                os.kill(process.pid, signal.SIGKILL)
+            self.assertEqual(pool.result(job), "IMPOSSIBLE")
+            self.assertEqual(pool.result(follower), "IMPOSSIBLE")
+            # One solve the first time, and one retry shared by both.
+            self.assertEqual(admission.admitted, 2)
+            self.assertEqual(admission.running, 0)
+        finally:
+            pool.close()
+
+
+class BatchTest(unittest.TestCase):
+
+    problems = [{"colors": 1, "customers": 1, "demands": [[1, 1, 1]]},
+                {"colors": 1, "customers": 2, "demands": [[1, 1, 0], [1, 1, 1]]},
+                {"colors": 2, "customers": 1, "demands": [[1, 2, 0]]},
+                {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]}]
+    expected = "Case #1: 1\nCase #2: IMPOSSIBLE\nCase #3: 0 0\nCase #4: 1 1 1\n"
+
+    def setUp(self):
+        self.client = paintshop.app.test_client()
+
+    def post(self, body, content_type='application/json', query=''):
+        response = self.client.post('/v2/batch' + query, data=body, content_type=content_type)
+        return response.status_code, response.get_data(as_text=True)
+
+    def test_json_array(self):
+        self.assertEqual(self.post(json.dumps(self.problems)), (200, self.expected))
+        self.assertEqual(self.post(json.dumps(self.problems), query='?bulk=1'), (200, self.expected))
+        self.assertEqual(self.post(json.dumps(self.problems[0])), (200, "Case #1: 1\n"))
+
+    def test_ndjson(self):
+        body = "".join(json.dumps(problem) + "\n" for problem in self.problems)
+        self.assertEqual(self.post(body, 'application/x-ndjson'), (200, self.expected))
+
+        # A bad line is answered in its place, and the rest still are.
+        lines = body.splitlines(True)
+        body = "".join(lines[:2]) + '{"colors": 1,\n' + "".join(lines[2:])
+        self.assertEqual(self.post(body, 'application/x-ndjson'),
+                         (200, "Case #1: 1\nCase #2: IMPOSSIBLE\nCase #3: IMPOSSIBLE\n"
+                               "Case #4: 0 0\nCase #5: 1 1 1\n"))
+
+    def test_malformed(self):
+        self.assertEqual(self.post('[{"colors": 1}')[0], 400)
+        self.assertEqual(self.post('5')[0], 400)
+        self.assertEqual(self.post(json.dumps(self.problems), 'application/x-ndjson'), (200, "Case #1: IMPOSSIBLE\n"))
+
+
+def slow_problem(colors):
+    # Impossible, but only found to be once the exhaustive engine has tried
+    # every finish of every undecided color, about 2 ** colors combinations.
+    demands = [[1, 1, 1], [2, 1, 0, 2, 1], [1, 2, 0]] + [[2, c, 0, c + 1, 1] for c in range(3, 3 + colors)]
+    return {"colors": colors + 4, "customers": len(demands), "demands": demands}
+
+
+class PoolTest(unittest.TestCase):
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_timeout(self):
+        self.pool = SolverPool(1, timeout=0.5)
+        executor = self.pool._executor
+        with self.assertRaises(SolverTimeout):
+            self.pool.solve(slow_problem(30), "exhaustive")
+        # The stuck worker's pool is replaced, and the next solve is fine.
+        self.assertIsNot(self.pool._executor, executor)
+        self.assertEqual(self.pool.solve(CoalesceTest.problem), "1 1 1")
+
+    def test_killed_worker(self):
+        self.pool = SolverPool(1)
+        executor = self.pool._executor
+        job = self.pool.submit(slow_problem(14), "exhaustive")
+        time.sleep(0.2)
+        for process in list(executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        # The job is solved again by a new pool.
+        self.assertEqual(self.pool.result(job), "IMPOSSIBLE")
+        self.assertIsNot(self.pool._executor, executor)
+        self.assertEqual(self.pool.solve(CoalesceTest.problem), "1 1 1")
+
+    def test_map_order(self):
+        self.pool = SolverPool(1, timeout=0.5)
+        problems = [make_problem(0), slow_problem(30), make_problem(1), make_problem(2)]
+        self.assertEqual(list(self.pool.map(problems, "exhaustive")), ["0", "TIMEOUT", "0 1", "0 0 0"])
+
+
+class ProfileTest(unittest.TestCase):
+
+    problem = {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stats = []
+        self.config = dict(paintshop.app.config)
+        paintshop.app.config.update({'pool': SolverPool(cache=ResultCache(), observer=self.stats.append),
+                                     'profiler': profiling.Profiler(self.directory)})
+        self.client = paintshop.app.test_client()
+
+    def tearDown(self):
+        paintshop.app.config.update(self.config)
+        shutil.rmtree(self.directory)
+
+    def replay(self, capture_id):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            return replay.main(Namespace(capture=os.path.join(self.directory, capture_id + ".json"),
+                                         engine=None, sort='cumulative', limit=5, output=None))
+        finally:
+            sys.stdout = stdout
+
+    def test_capture_round_trip(self):
+        response = self.client.post('/v1/?profile=1', data=json.dumps(self.problem))
+        self.assertEqual(response.data, b"1 1 1")
+        capture_id = response.headers['X-Profile-Id']
+        self.assertTrue(os.path.exists(os.path.join(self.directory, capture_id + ".prof")))
+        with open(os.path.join(self.directory, capture_id + ".json")) as f:
+            capture = json.load(f)
+        self.assertEqual(profiling.decode_problem(capture["problem"]), self.problem)
+        self.assertEqual(capture["result"], "1 1 1")
+        self.assertEqual(self.replay(capture_id), 0)
+        self.assertEqual(len(self.stats), 1)
+
+        # Answered from the cache, so not profiled again.
+        response = self.client.post('/v1/', data=json.dumps(self.problem), headers={'X-Profile': '1'})
+        self.assertEqual(response.data, b"1 1 1")
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_packed_round_trip(self):
+        prefs = Preferences.from_demands(3, self.problem["demands"])
+        response = self.client.post('/v1/?profile=1', data=prefs.to_bytes(), content_type='application/octet-stream')
+        capture_id = response.headers['X-Profile-Id']
+        with open(os.path.join(self.directory, capture_id + ".json")) as f:
+            demands = profiling.decode_problem(json.load(f)["problem"])["demands"]
+        self.assertEqual(demands.to_bytes(), prefs.to_bytes())
+        self.assertEqual(self.replay(capture_id), 0)
+
+    def test_one_at_a_time(self):
+        paintshop.app.config['profiler'].rate = 1.0
+        with profiling._profiling:
+            response = self.client.post('/v1/?profile=1', data=json.dumps(self.problem))
+            self.assertEqual((response.status_code, response.data), (409, b"PROFILER_BUSY"))
+            # A sampled request is solved without the profiler.
+            response = self.client.post('/v1/', data=json.dumps(self.problem))
+            self.assertEqual((response.status_code, response.data), (200, b"1 1 1"))
+            self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(len(self.stats), 1)
+
+
+class ProblemKeyTest(unittest.TestCase):
+
+    def test_order_ignored(self):
+        demands = [[2, 3, 0, 1, 1], [1, 2, 0]]
+        self.assertEqual(normalise_demands(demands), [[1, 2, 0], [2, 1, 1, 3, 0]])
+        self.assertEqual(normalise_demands([[1, 2, 0], [2, 1, 1, 3, 0]]), normalise_demands(demands))
+        self.assertEqual(problem_key({"colors": 3, "customers": 2, "demands": demands}),
+                         problem_key({"colors": 3, "customers": 2, "demands": [[1, 2, 0], [2, 1, 1, 3, 0]]}))
+        self.assertNotEqual(problem_key({"colors": 3, "customers": 2, "demands": demands}),
+                            problem_key({"colors": 3, "customers": 2, "demands": [[1, 2, 1], [2, 1, 1, 3, 0]]}))
+
+    def test_malformed_hashed_as_sent(self):
+        for demands in ([[2, 3, 0, 1]], [[1, 2, "0"], [1, 1, 0]], [[1, 2, True]], "x", None):
+            self.assertEqual(normalise_demands(demands), demands)
+        self.assertNotEqual(problem_key({"colors": 3, "customers": 2, "demands": [[1, 2, "0"], [1, 1, 0]]}),
+                            problem_key({"colors": 3, "customers": 2, "demands": [[1, 1, 0], [1, 2, "0"]]}))
+        self.assertNotEqual(problem_key({"colors": 1, "customers": 1, "demands": [[1, 1, True]]}),
+                            problem_key({"colors": 1, "customers": 1, "demands": [[1, 1, 1]]}))
+        # Not even a dict.
+        self.assertEqual(problem_key([1, 2]), problem_key([1, 2]))
+
+    def test_packed_keyed_like_json(self):
+        demands = [[2, 3, 0, 1, 1], [1, 2, 0]]
+        packed = Preferences.from_demands(3, demands)
+        self.assertEqual(problem_key({"colors": 3, "customers": 2, "demands": packed}),
+                         problem_key({"colors": 3, "customers": 2, "demands": demands}))
+
+        # Offsets that don't delimit the paints.
+        broken = Preferences(3, [0, 2, 1], packed.paint_colors, packed.finishes)
+        self.assertEqual(normalise_demands(broken), ["packed", broken.to_bytes().hex()])
+
+
+class GatedCache(ResultCache):
+    # Holds the solve in flight by blocking claim() until the gate opens.
+
+    def __init__(self):
+        ResultCache.__init__(self)
+        self.claimed = threading.Event()
+        self.gate = threading.Event()
+
+    def claim(self, key):
+        self.claimed.set()
+        self.gate.wait()
+        return None
+
+
+class CliTest(unittest.TestCase):
+
+    content = "2\n3\n3\n1 1 1\n2 1 0 2 1\n3 1 0 2 0 3 1\n\n1\n2\n1 1 0\n1 1 1\n"
+
+    def run_cli(self, content, *argv):
+        path = os.path.join(self.directory, "input.txt")
+        with open(path, "w") as f:
+            f.write(content)
+        stdout, stderr, sys.stdout, sys.stderr = sys.stdout, sys.stderr, StringIO(), StringIO()
+        try:
+            code = cli.main(cli.parse_args(list(argv) + [path]))
+            return code, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_cases(self):
+        self.assertEqual(list(cli.read_cases(StringIO(self.content))), [
+            {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]},
+            {"colors": 1, "customers": 2, "demands": [[1, 1, 0], [1, 1, 1]]}])
+        self.assertEqual(list(cli.read_cases(StringIO(""))), [])
+        expected = "Case #1: 1 1 1\nCase #2: IMPOSSIBLE\n"
+        self.assertEqual(self.run_cli(self.content), (0, expected, ""))
+        self.assertEqual(self.run_cli(self.content, "--bulk", "10"), (0, expected, ""))
+
+    def test_truncated(self):
+        cases = cli.read_cases(StringIO(self.content.rstrip().rsplit("\n", 1)[0]))
+        next(cases)
+        with self.assertRaisesRegex(ValueError, "case 2: expected 2 customers, but the input ended after 1"):
+            next(cases)
+        with self.assertRaisesRegex(ValueError, "case 2: expected N and M"):
+            list(cli.read_cases(StringIO("2\n1\n1\n1 1 0\n1\n")))
+
+        # The cases before are still answered.
+        code, stdout, stderr = self.run_cli(self.content[:-len("1 1 1\n")])
+        self.assertEqual((code, stdout), (1, "Case #1: 1 1 1\n"))
+        self.assertIn("case 2: expected 2 customers", stderr)
+
+    def test_bulk_engine(self):
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                cli.parse_args(["--bulk", "10", "--engine", "exhaustive"])
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(cli.parse_args(["--bulk", "10", "--engine", "greedy"]).bulk, 10)
+
+
+class CoalesceTest(unittest.TestCase):
+
+    problem = {"colors": 3, "customers": 3, "demands": [[1, 1, 1], [2, 1, 0, 2, 1], [3, 1, 0, 2, 0, 3, 1]]}
+
+    def start_leader(self, pool, engine):
+        leader = {}
+        thread = threading.Thread(target=lambda: leader.update(job=pool.submit(self.problem, engine)))
+        thread.start()
+        pool.cache.claimed.wait()
+        return leader, thread
+
+    def test_followers_share_solve(self):
+        solves = []
+        pool = SolverPool(cache=GatedCache(), observer=solves.append)
+        leader, thread = self.start_leader(pool, "greedy")
+        followers = [pool.submit(self.problem) for _ in range(3)]
+        self.assertEqual(len(pool._flights), 1)
+        pool.cache.gate.set()
+        thread.join()
+
+        self.assertEqual([pool.result(job) for job in [leader["job"]] + followers], ["1 1 1"] * 4)
+        self.assertEqual(len(solves), 1)
+        self.assertEqual(pool._flights, {})
+
+    def test_leader_error_reaches_followers(self):
+        pool = SolverPool(cache=GatedCache())
+        leader, thread = self.start_leader(pool, "no such engine")
+        followers = [pool.submit(self.problem, "no such engine") for _ in range(3)]
+        pool.cache.gate.set()
+        thread.join()
+
+        for job in [leader["job"]] + followers:
+            with self.assertRaises(ValueError):
+                pool.result(job)
+        self.assertEqual(pool._flights, {})
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def test_threads_started_on_first_job(self):
+        jobs = JobQueue(SolverPool(), workers=2)
+        self.assertEqual(jobs._threads, [])
+        # Answered without solving, so no thread is needed.
+        self.assertEqual(jobs.submit([1, 2]).state, DONE)
+        self.assertEqual(jobs._threads, [])
+
+        job = jobs.submit(CoalesceTest.problem)
+        self.assertEqual(len(jobs._threads), 2)
+        jobs.submit(CoalesceTest.problem)
+        self.assertEqual(len(jobs._threads), 2)
+        for _ in range(500):
+            if job.state == DONE:
+                break
+            time.sleep(0.01)
+        self.assertEqual(job.result, "1 1 1")
+
+
+    def wait(self, job, states=(DONE, TIMEOUT)):
+        for _ in range(500):
+            if job.state in states:
+                break
+            time.sleep(0.01)
+        return job.state
+
+    def test_deadline(self):
+        jobs = JobQueue(SolverPool(), deadline=0.3)
+        job = jobs.submit(slow_problem(30), "exhaustive")
+        self.assertEqual(self.wait(job), TIMEOUT)
+        self.assertEqual(job.result, "TIMEOUT")
+        # The thread is free for the next job.
+        self.assertEqual(self.wait(jobs.submit(CoalesceTest.problem)), DONE)
+
+    def test_cpu_budget(self):
+        jobs = JobQueue(SolverPool(admission=Admission(cpu_budget=0.3)))
+        job = jobs.submit(slow_problem(30), "exhaustive")
+        self.assertEqual(self.wait(job), TIMEOUT)
+        self.assertLess(job.status()['running_seconds'], 2)
+
+    def test_admitted(self):
+        admission = Admission(capacity=1.0, wait=0.05, max_memory=10 ** 6)
+        jobs = JobQueue(SolverPool(admission=admission))
+        with self.assertRaises(SolverTooLarge):
+            jobs.submit(slow_problem(1000), "exhaustive")
+
+        # With no room, the job waits rather than being refused.
+        cost = admission.admit(slow_problem(30), "exhaustive")
+        job = jobs.submit(CoalesceTest.problem, "exhaustive")
+        time.sleep(0.2)
+        self.assertEqual((job.state, job.control.iterations), (RUNNING, 0))
+        admission.release(cost)
+        self.assertEqual(self.wait(job), DONE)
+        self.assertEqual(job.result, "1 1 1")
+        self.assertEqual(admission.running, 0)
+
+    def test_too_large(self):
+        config = dict(paintshop.app.config)
+        pool = SolverPool(admission=Admission(max_memory=1000))
+        paintshop.app.config.update({'pool': pool, 'jobs': JobQueue(pool)})
+        try:
+            response = paintshop.app.test_client().post('/v2/jobs', data=json.dumps(CoalesceTest.problem))
+        finally:
+            paintshop.app.config.update(config)
+        self.assertEqual((response.status_code, response.data), (413, b"TOO_LARGE"))
+
+
+class ClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(directory=self.directory)
+        self.key = problem_key(make_problem(0))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lock_files(self):
+        return [name for _, _, names in os.walk(self.directory) for name in names if name.endswith(".lock")]
+
+    def test_release_removes_lock_file(self):
+        lock = self.cache.claim(self.key)
+        self.assertEqual(len(self.lock_files()), 1)
+        self.cache.release(lock)
+        self.assertEqual(self.lock_files(), [])
+
+    def test_waiter_takes_new_lock(self):
+        lock = self.cache.claim(self.key)
+        waiter = {}
+        thread = threading.Thread(target=lambda: waiter.update(lock=self.cache.claim(self.key)))
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        self.cache.release(lock)
+        thread.join()
+        # The waiter holds the file now at the path, not the one removed.
+        self.assertEqual(os.stat(waiter["lock"].name).st_ino, os.fstat(waiter["lock"].fileno()).st_ino)
+        self.cache.release(waiter["lock"])
+        self.assertEqual(self.lock_files(), [])
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.key = problem_key(make_problem(0))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def results(self):
+        return sorted(name for _, _, names in os.walk(self.directory) for name in names)
+
+    def test_expired_on_disk(self):
+        ResultCache(ttl=60, directory=self.directory).put(self.key, "IMPOSSIBLE")
+        path = os.path.join(self.directory, self.key[:2], self.key)
+        written = time.time() - 120
+        os.utime(path, (written, written))
+
+        # A fresh cache, as after a restart, doesn't serve the stale result.
+        self.assertIsNone(ResultCache(ttl=60, directory=self.directory).get(self.key))
+        self.assertFalse(os.path.exists(path))
+
+    def test_disk_hit_keeps_its_age(self):
+        ResultCache(ttl=60, directory=self.directory).put(self.key, "IMPOSSIBLE")
+        path = os.path.join(self.directory, self.key[:2], self.key)
+        written = time.time() - 59.5
+        os.utime(path, (written, written))
+
+        cache = ResultCache(ttl=60, directory=self.directory)
+        self.assertEqual(cache.get(self.key), "IMPOSSIBLE")
+        time.sleep(0.6)
+        self.assertIsNone(cache.get(self.key))
+
+    def test_prune(self):
+        cache = ResultCache(ttl=60, directory=self.directory, disk_maxsize=3)
+        keys = [problem_key(make_problem(i)) for i in range(5)]
+        for i, key in enumerate(keys):
+            cache.put(key, "IMPOSSIBLE")
+            written = time.time() - 50 + i
+            os.utime(os.path.join(self.directory, key[:2], key), (written, written))
+        # Neither lock files nor the results being written are counted.
+        lock = cache.claim(keys[0])
+
+        self.assertEqual(cache.prune(), 2)
+        self.assertEqual(self.results(), sorted(keys[2:] + [keys[0] + ".lock"]))
+        cache.release(lock)
+
+    def test_prune_expired(self):
+        cache = ResultCache(ttl=60, directory=self.directory)
+        cache.put(self.key, "IMPOSSIBLE")
+        path = os.path.join(self.directory, self.key[:2], self.key)
+        written = time.time() - 120
+        os.utime(path, (written, written))
+
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(self.results(), [])
+
+    def test_concurrent_claims(self):
+        # Claims racing to make the same subdirectory all get their lock.
+        keys = ["ab%030d" % i for i in range(16)]
+        locks = {}
+        caches = [ResultCache(directory=self.directory) for _ in keys]
+        threads = [threading.Thread(target=lambda c=c, k=k: locks.update({k: c.claim(k)})) for c, k in zip(caches, keys)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(locks[key] is not None for key in keys))
+        for cache, key in zip(caches, keys):
+            cache.release(locks[key])
+
+
+class ServeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # serve.py makes a metrics directory unless given one.
+        cls.metrics = tempfile.mkdtemp()
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = cls.metrics
+        import serve
+        cls.serve = serve
+
+    @classmethod
+    def tearDownClass(cls):
+        del os.environ['PROMETHEUS_MULTIPROC_DIR']
+        shutil.rmtree(cls.metrics)
+
+    def test_load(self):
+        self.serve.warm()
+        server = self.serve.Server(self.serve.parse_args(['--port', '18080', '--monitor', '18081']))
+        self.assertIs(server.load(), paintshop.app)
+
+    def test_load_config(self):
+        args = self.serve.parse_args(['--port', '18080', '--monitor', '18081', '--processes', '3', '--threads', '5',
+                                 '--worker-timeout', '7', '--graceful-timeout', '9', '--stateless'])
+        cfg = self.serve.Server(args).cfg
+        self.assertEqual(cfg.bind, ['0.0.0.0:18080'])
+        self.assertEqual((cfg.workers, cfg.threads, cfg.worker_class_str), (3, 5, 'gthread'))
+        self.assertEqual((cfg.timeout, cfg.graceful_timeout), (7, 9))
+        self.assertTrue(cfg.preload_app)
+
+        cfg = self.serve.Server(self.serve.parse_args(['--port', '18080', '--monitor', '18081', '--threads', '1'])).cfg
+        self.assertEqual((cfg.workers, cfg.worker_class_str), (1, 'sync'))
+
+    def test_processes_need_stateless(self):
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                self.serve.parse_args(['--port', '18080', '--monitor', '18081', '--processes', '2'])
+        finally:
+            sys.stderr = stderr
+
+    def test_stateless(self):
+        client = paintshop.app.test_client()
+        paintshop.app.config['stateful'] = False
+        try:
+            self.assertEqual(client.post('/v2/sessions', data=json.dumps(CoalesceTest.problem)).status_code, 501)
+            self.assertEqual(client.post('/v2/jobs', data=json.dumps(CoalesceTest.problem)).status_code, 501)
+            self.assertEqual(client.post('/v1/', data=json.dumps(CoalesceTest.problem)).status_code, 200)
+        finally:
+            paintshop.app.config['stateful'] = True
+
+
+class SessionsTest(unittest.TestCase):
+
+    problem = {"colors": 2, "customers": 1, "demands": [[1, 1, 1]]}
+
+    def setUp(self):
+        self.client = paintshop.app.test_client()
+        self.sessions = paintshop.app.config['sessions']
+        paintshop.app.config['sessions'] = Sessions(maxsize=2, ttl=60)
+
+    def tearDown(self):
+        paintshop.app.config['sessions'] = self.sessions
+
+    def create(self):
+        return json.loads(self.client.post('/v2/sessions', data=json.dumps(self.problem)).data)['id']
+
+    def test_least_recently_used_evicted(self):
+        first, second = self.create(), self.create()
+        self.assertEqual(self.client.get('/v2/sessions/' + first).data, b"1 0")
+        third = self.create()
+        self.assertEqual(self.client.get('/v2/sessions/' + second).status_code, 404)
+        self.assertEqual(self.client.get('/v2/sessions/' + first).status_code, 200)
+        self.assertEqual(self.client.get('/v2/sessions/' + third).status_code, 200)
+        self.assertEqual(len(paintshop.app.config['sessions']), 2)
+
+    def test_idle_expired(self):
+        sessions = paintshop.app.config['sessions']
+        first, second = self.create(), self.create()
+        # Make the first look idle for longer than the TTL.
+        lock, session, used = sessions._entries[first]
+        sessions._entries[first] = (lock, session, used - 61)
+        self.assertEqual(self.client.get('/v2/sessions/' + first).status_code, 404)
+        self.assertEqual(self.client.put('/v2/sessions/' + first + '/colors', data='3').status_code, 404)
+        self.assertEqual(self.client.get('/v2/sessions/' + second).status_code, 200)
+        self.assertEqual(len(sessions), 1)
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, 'solutions.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        problem = make_problem(0)
+        solutions = SolutionStore(self.directory)
+        self.assertIsNone(solutions.get(problem_key(problem)))
+        solutions.put(problem_key(problem), problem, "1")
+        self.assertEqual(solutions.get(problem_key(problem)), "1")
+
+        # A problem keeps its first solution.
+        solutions.put(problem_key(problem), problem, "0")
+        self.assertEqual(solutions.get(problem_key(problem)), "1")
+        solutions.close()
+
+        solutions = SolutionStore(self.directory)
+        self.assertEqual(solutions.get(problem_key(problem)), "1")
+        self.assertEqual(solutions.index.count, 1)
+        solutions.close()
+
+    def test_growth(self):
+        n = int(store.MIN_SLOTS * store.MAX_LOAD) + 100
+        solutions = SolutionStore(self.directory)
+        for i in range(n):
+            solutions.put(problem_key(make_problem(i)), make_problem(i), str(i))
+        self.assertGreater(solutions.index.slots, store.MIN_SLOTS)
+        self.assertEqual(solutions.index.count, n)
+        solutions.close()
+
+        solutions = SolutionStore(self.directory)
+        for i in range(n):
+            self.assertEqual(solutions.get(problem_key(make_problem(i))), str(i))
+        solutions.close()
+        self.assertEqual(store.check(self.directory), [])
+
+    def test_reopen_after_partial_append(self):
+        solutions = SolutionStore(self.directory)
+        solutions.put(problem_key(make_problem(0)), make_problem(0), "0")
+        solutions.close()
+        size = os.path.getsize(self.data_path)
+
+        # Another process wrote a record but not the index, then a write was cut short.
+        with open(self.data_path, 'ab') as f:
+            f.write(encode_record(make_problem(1), "1"))
+            f.write(encode_record(make_problem(2), "2")[:-1])
+
+        solutions = SolutionStore(self.directory)
+        self.assertEqual(solutions.get(problem_key(make_problem(1))), "1")
+        self.assertIsNone(solutions.get(problem_key(make_problem(2))))
+        self.assertEqual(os.path.getsize(self.data_path), size + len(encode_record(make_problem(1), "1")))
+
+        solutions.put(problem_key(make_problem(2)), make_problem(2), "2")
+        self.assertEqual(solutions.get(problem_key(make_problem(2))), "2")
+        solutions.close()
+        self.assertEqual(store.check(self.directory), [])
+
+    def test_check_bad_crc(self):
+        solutions = SolutionStore(self.directory)
+        solutions.put(problem_key(make_problem(0)), make_problem(0), "0")
+        solutions.close()
+
+        # Corrupt the result, the record's last byte.
+        with open(self.data_path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"1")
+
+        errors = store.check(self.directory)
+        self.assertIn("record at %d fails its CRC" % len(DATA_MAGIC), errors)
+
+    def test_compact_drops_duplicates(self):
+        solutions = SolutionStore(self.directory)
+        for i in range(3):
+            solutions.put(problem_key(make_problem(i)), make_problem(i), str(i))
+        solutions.close()
+        size = os.path.getsize(self.data_path)
+
+        with open(self.data_path, 'ab') as f:
+            f.write(encode_record(make_problem(1), "9"))
+
+        self.assertEqual(store.compact(self.directory), 1)
+        self.assertEqual(os.path.getsize(self.data_path), size)
+        self.assertEqual(store.check(self.directory), [])
+
+        solutions = SolutionStore(self.directory)
+        self.assertEqual([solutions.get(problem_key(make_problem(i))) for i in range(3)], ["0", "1", "2"])
+        solutions.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
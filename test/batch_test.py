@@ -1,16 +1,17 @@
 #!/usr/bin/env python3
 
 import sys
+import json
 import urllib.request
 import os
 URL=os.environ.get('PAINTSHOP_URL', "0.0.0.0:8080/v1")
+BATCH_URL=os.environ.get('PAINTSHOP_BATCH_URL', "0.0.0.0:8080/v2/batch")
 
 def no_space_list(input_list):
     return '['+','.join(map(str, input_list))+']'
 
 
-def process_content(content):
-    output = []
+def parse_cases(content):
     testcases = int(content[0])
     content = content[1:]
     for c in range(testcases):
@@ -20,24 +21,44 @@ def process_content(content):
         for l in range(number_of_customers):
             demand = list(map(int, content[l+2].split()))
             customer_demand.append(demand)
+        yield number_of_colors, number_of_customers, customer_demand
+        content = content[number_of_customers + 2:]
+
+
+def process_content(content):
+    output = []
+    for c, (number_of_colors, number_of_customers, customer_demand) in enumerate(parse_cases(content)):
         no_space_demands = '['+','.join(map(no_space_list, customer_demand))+']'
         solution = urllib.request.urlopen("http://{}/?input={{\"colors\":{},\"customers\":{},\"demands\":{}}}".format(URL, number_of_colors, number_of_customers, no_space_demands)).read()
         output.append("Case #{}: {}".format(c + 1, solution.decode('utf-8')))
-        content = content[number_of_customers + 2:]
-    return output	
+    return output
+
+
+def process_content_batch(content):
+    # Send every case in a single POST, one JSON problem per line.
+    body = ''.join(json.dumps({"colors": colors, "customers": customers, "demands": demands}, separators=(',', ':')) + '\n'
+                   for colors, customers, demands in parse_cases(content))
+    req = urllib.request.Request("http://{}".format(BATCH_URL), data=body.encode('utf-8'),
+                                 headers={'Content-Type': 'application/x-ndjson'})
+    with urllib.request.urlopen(req) as response:
+        return [line.decode('utf-8').rstrip('\n') for line in response]
+
 
-def main(input_file):
+def main(input_file, batch=False):
     with open(input_file) as f:
         content = f.readlines()
     content = [x.strip() for x in content]
-    for line in process_content(content):
+    process = process_content_batch if batch else process_content
+    for line in process(content):
         print(line)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        main(sys.argv[1])
+    batch = '--batch' in sys.argv[1:]
+    args = [a for a in sys.argv[1:] if a != '--batch']
+    if len(args) > 0:
+        main(args[0], batch)
     elif 'input.txt' in os.listdir('.'):
-        main('input.txt')
+        main('input.txt', batch)
     else:
-        print("Where is my input? input.txt does not exist, Create one, or provide a filename as an argument")
\ No newline at end of file
+        print("Where is my input? input.txt does not exist, Create one, or provide a filename as an argument")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#usage: ./benchmark.py [--baseline benchmarks/baseline.json] [--output results.json] [--update-baseline]
+"""
+Times validation, optimisation and the whole solver() call over seeded
+problems of increasing size, up to the documented limits, and the time a
+fresh process takes to import the solver and answer a problem. Results are
+written as JSON and compared against a stored baseline; the exit status is
+non-zero if any stage of any profile has slowed down beyond the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+solver_dir = os.path.join(base_dir, "..", "app", "solver")
+sys.path.insert(0, solver_dir)
+
+import numpy as np
+
+from generate import generate_problem
+from solver import solver
+
+DEFAULT_BASELINE = os.path.join(base_dir, "benchmarks", "baseline.json")
+
+# name: (colors, customers, paints, matte density, fraction unsatisfiable, problems)
+PROFILES = {
+    "tiny": (10, 5, 10, 0.2, 0.5, 200),
+    "small": (100, 50, 150, 0.1, 0.5, 100),
+    "medium": (500, 500, 1000, 0.1, 0.5, 40),
+    "wide": (2000, 500, 3000, 0.05, 0.5, 20),
+    "max": (2000, 2000, 3000, 0.1, 0.5, 20),
+    "max_matte": (2000, 2000, 3000, 0.5, 0.5, 20),
+    "max_satisfiable": (2000, 2000, 3000, 0.1, 0.0, 20),
+}
+
+STAGES = ("check", "optimise", "solver")
+
+# Fresh processes started to time the import of the solver.
+STARTUP_SAMPLES = 10
+STARTUP_CODE = ("import sys, time; start = time.perf_counter(); from solver import solver; "
+                "solver({'colors': 1, 'customers': 1, 'demands': [[1, 1, 1]]}); "
+                "print(time.perf_counter() - start, 'pandas' in sys.modules)")
+
+
+def run_profile(name, seed, engine, repeat):
+    colors, customers, paints, matte_density, unsatisfiable, count = PROFILES[name]
+    rng = random.Random("%s-%d" % (name, seed))
+    problems = [generate_problem(rng, colors, customers, paints, matte_density,
+                                 satisfiable=rng.random() >= unsatisfiable)
+                for _ in range(count)]
+
+    timings = {stage: [] for stage in STAGES}
+    impossible = 0
+    for problem in problems:
+        # Keep the quickest of the repeats, which is the least disturbed by noise.
+        best = {}
+        for _ in range(repeat):
+            stats = {}
+            start = time.perf_counter()
+            result = solver(problem, engine=engine, stats=stats)
+            elapsed = {"solver": time.perf_counter() - start}
+
+            stages = stats["stages"]
+            elapsed["check"] = sum(t for stage, t in stages.items()
+                                   if stage not in ("optimise", "format_response"))
+            if "optimise" in stages:
+                elapsed["optimise"] = stages["optimise"]
+            for stage, seconds in elapsed.items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+
+        for stage, seconds in best.items():
+            timings[stage].append(seconds)
+        impossible += result == "IMPOSSIBLE"
+
+    return {
+        "params": {"colors": colors, "customers": customers, "paints": paints,
+                   "matte_density": matte_density, "unsatisfiable": unsatisfiable, "problems": count},
+        "impossible": impossible,
+        "stages": {stage: summarise(times) for stage, times in timings.items() if times},
+    }
+
+
+def run_startup(repeat):
+    """
+    Time importing the solver and answering a trivial problem in a new
+    interpreter, which is what every short-lived CLI or batch job pays.
+    """
+    timings = []
+    pandas_loaded = False
+    for _ in range(STARTUP_SAMPLES):
+        best = None
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, "-c", STARTUP_CODE], cwd=solver_dir)
+            seconds, loaded = output.decode().split()
+            best = min(float(seconds), best or float(seconds))
+            pandas_loaded = pandas_loaded or loaded == "True"
+        timings.append(best)
+
+    return {
+        "params": {"problems": STARTUP_SAMPLES},
+        "impossible": 0,
+        "pandas_loaded": pandas_loaded,
+        "stages": {"import": summarise(timings)},
+    }
+
+
+def summarise(times):
+    times = np.array(times)
+    return {
+        "median": float(np.median(times)),
+        "p95": float(np.percentile(times, 95)),
+        "max": float(times.max()),
+    }
+
+
+def compare(results, baseline, tolerance, floor, startup_target=None):
+    """
+    :return: A list of regression descriptions, empty if there are none.
+    """
+    regressions = []
+    startup = results["profiles"].get("startup")
+    if startup is not None:
+        if startup["pandas_loaded"]:
+            regressions.append("startup: the solver imported pandas")
+        median = startup["stages"]["import"]["median"]
+        if startup_target is not None and median > startup_target:
+            regressions.append("startup/import: median %.3fms, target %.3fms" %
+                               (median * 1000, startup_target * 1000))
+    for name, profile in results["profiles"].items():
+        base_profile = baseline.get("profiles", {}).get(name)
+        if base_profile is None:
+            continue
+        if profile["impossible"] != base_profile["impossible"]:
+            regressions.append("%s: %d IMPOSSIBLE answers, baseline had %d" %
+                               (name, profile["impossible"], base_profile["impossible"]))
+        for stage, summary in profile["stages"].items():
+            base = base_profile["stages"].get(stage)
+            if base is None:
+                continue
+            now, before = summary["median"], base["median"]
+            # Ignore noise on stages too quick to matter.
+            if now > before * (1 + tolerance) and now - before > floor:
+                regressions.append("%s/%s: median %.3fms, baseline %.3fms" %
+                                   (name, stage, now * 1000, before * 1000))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', type=str, default=",".join(sorted(PROFILES) + ["startup"]),
+                        help='comma separated profiles to run, including "startup"')
+    parser.add_argument('--engine', type=str, default="greedy", help='the solver engine')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of times each problem is solved')
+    parser.add_argument('--output', type=str, default=None, help='where to write the results')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='the baseline to compare to')
+    parser.add_argument('--update-baseline', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='the fractional slowdown of a median allowed before failing')
+    parser.add_argument('--floor', type=float, default=0.0005,
+                        help='slowdowns smaller than this many seconds are ignored')
+    parser.add_argument('--startup-target', type=float, default=0.5,
+                        help='the most seconds a new process may take to import the solver and solve')
+    return parser.parse_args()
+
+
+def main(args):
+    results = {
+        "engine": args.engine,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "profiles": {},
+    }
+    for name in args.profiles.split(","):
+        if name == "startup":
+            profile = run_startup(args.repeat)
+        else:
+            profile = run_profile(name, args.seed, args.engine, args.repeat)
+        results["profiles"][name] = profile
+        print("%-16s %s" % (name, "  ".join("%s %.3fms" % (stage, summary["median"] * 1000)
+                                             for stage, summary in sorted(profile["stages"].items()))))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at %s, nothing to compare against" % args.baseline)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("engine") != args.engine or baseline.get("seed") != args.seed:
+        print("Baseline was recorded with a different engine or seed, not comparing")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.floor, args.startup_target)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#usage: ./fuzz.py [--seed 0] [--cases 2000] [--max-colors 8] [--engines greedy,exhaustive]
+"""
+Differential testing of the solver backends. Small random problems, some
+built by generate.py and some with no structure at all, are solved by every
+backend, which must all give the same answer: the same IMPOSSIBLE verdicts
+and the same minimum-matte solution. The time each backend took in total is
+reported relative to the quickest. The exit status is non-zero if any
+problem was answered differently, and the first few such problems are shown.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(base_dir, "..", "app", "solver"))
+
+from backends import BACKENDS
+from generate import generate_problem
+from solver import solver
+
+
+def random_problem(rng, max_colors):
+    """
+    A problem with random preferences. Unlike generate_problem, nothing stops
+    single paint customers from clashing, and customers may like no paints.
+    """
+    colors = rng.randint(1, max_colors)
+    demands = []
+    for _ in range(rng.randint(1, colors)):
+        # Now and then a customer likes no paints at all (T = 0).
+        picked = rng.sample(range(1, colors + 1), rng.randint(0 if rng.random() < 0.02 else 1, min(3, colors)))
+        finishes = [0] * len(picked)
+        if picked and rng.random() < 0.6:
+            finishes[rng.randrange(len(picked))] = 1
+        demands.append([len(picked)] + [i for pair in zip(picked, finishes) for i in pair])
+    return {"colors": colors, "customers": len(demands), "demands": demands}
+
+
+def structured_problem(rng, max_colors):
+    while True:
+        colors = rng.randint(1, max_colors)
+        customers = rng.randint(1, colors)
+        paints = rng.randint(customers, min(3 * customers, customers * colors))
+        try:
+            return generate_problem(rng, colors, customers, paints, rng.uniform(0, 0.6),
+                                    satisfiable=rng.random() < 0.5, chain=rng.randint(1, 4))
+        except ValueError:
+            # Too small for the chain of an unsatisfiable problem.
+            continue
+
+
+def run(seed, cases, max_colors, engines):
+    """
+    :return: The seconds spent by each engine, the number of impossible
+             problems and a list of (problem, answers) disagreements.
+    """
+    rng = random.Random(seed)
+    seconds = dict.fromkeys(engines, 0.0)
+    impossible = 0
+    disagreements = []
+    for i in range(cases):
+        make = random_problem if i % 2 else structured_problem
+        problem = make(rng, max_colors)
+
+        answers = {}
+        for engine in engines:
+            start = time.perf_counter()
+            answers[engine] = solver(problem, engine)
+            seconds[engine] += time.perf_counter() - start
+
+        if len(set(answers.values())) > 1:
+            disagreements.append((problem, answers))
+        impossible += answers[engines[0]] == "IMPOSSIBLE"
+    return seconds, impossible, disagreements
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('--cases', type=int, default=2000, help='the number of problems')
+    parser.add_argument('--max-colors', type=int, default=8,
+                        help='the most colors in a problem (the exhaustive engine is exponential in this)')
+    parser.add_argument('--engines', type=str, default=",".join(sorted(BACKENDS)),
+                        help='comma separated engines to compare')
+    return parser.parse_args()
+
+
+def main(args):
+    engines = args.engines.split(",")
+    seconds, impossible, disagreements = run(args.seed, args.cases, args.max_colors, engines)
+
+    print("%d problems, %d impossible" % (args.cases, impossible))
+    quickest = min(seconds.values()) or 1e-9
+    for engine in sorted(engines, key=seconds.get):
+        print("%-12s %9.3fs %8.1fx" % (engine, seconds[engine], seconds[engine] / quickest))
+
+    for problem, answers in disagreements[:5]:
+        print("DISAGREEMENT %s %s" % (json.dumps(problem), json.dumps(answers, sort_keys=True)))
+    if disagreements:
+        print("%d problems answered differently" % len(disagreements))
+    return 1 if disagreements else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#usage: ./generate.py --seed 1 --cases 10 --colors 2000 --customers 2000 --paints 3000 > input.txt
+"""
+Seeded generator of well formed paint problems, up to the documented
+limits (N, M <= 2000, sum of T <= 3000).
+
+Satisfiable problems are built around a hidden assignment of finishes which
+every customer has at least one paint consistent with. Unsatisfiable ones
+additionally contain a chain of customers that forces one matte after
+another until the last of them can't be satisfied.
+"""
+import sys
+import random
+import argparse
+
+MAX_COLORS = 2000
+MAX_CUSTOMERS = 2000
+MAX_PAINTS = 3000
+
+
+def generate_problem(rng, colors, customers, paints, matte_density=0.1, satisfiable=True, chain=5):
+    """
+    :param rng: A random.Random instance.
+    :param colors: N, the number of paint colors.
+    :param customers: M, the number of customers (at most N).
+    :param paints: The sum of T over all customers.
+    :param matte_density: The fraction of colors that are matte in the hidden
+                          assignment, and so the share of matte preferences.
+    :param satisfiable: Whether the problem should have a solution.
+    :param chain: The number of customers in the conflicting chain of an
+                  unsatisfiable problem.
+    :return: A {colors, customers, demands} problem.
+    """
+    if not 1 <= customers <= colors <= MAX_COLORS or customers > MAX_CUSTOMERS:
+        raise ValueError("Need 1 <= customers <= colors <= %d" % MAX_COLORS)
+    if not customers <= paints <= min(MAX_PAINTS, customers * colors):
+        raise ValueError("Need customers <= paints <= min(%d, customers * colors)" % MAX_PAINTS)
+
+    hidden = [1 if rng.random() < matte_density else 0 for _ in range(colors + 1)]
+    demands = []
+    single = set()
+
+    if not satisfiable:
+        # Customer i+1 loses its glossy option to the matte customer i was forced into.
+        chain = max(1, min(chain, customers - 2, colors, paints - customers + 1))
+        links = rng.sample(range(1, colors + 1), chain)
+        for color in links:
+            hidden[color] = 1
+        demands.append([1, links[0], 1])
+        for previous, color in zip(links, links[1:]):
+            demands.append([2, previous, 0, color, 1])
+        demands.append([1, links[-1], 0])
+        single.update([(links[0], 1), (links[-1], 0)])
+        customers -= len(demands)
+        paints -= 2 * chain
+        if customers < 0 or (customers == 0) != (paints == 0) or paints > customers * colors:
+            raise ValueError("Too few customers or paints for an unsatisfiable problem")
+
+    # Spread the pairs beyond the first of each customer at random.
+    sizes = [1] * customers
+    for _ in range(paints - customers):
+        cust = rng.randrange(customers)
+        while sizes[cust] >= colors:
+            cust = rng.randrange(customers)
+        sizes[cust] += 1
+
+    for size in sizes:
+        picked = rng.sample(range(1, colors + 1), size)
+        if size == 1:
+            # Two single paint customers can't share a paint.
+            while (picked[0], hidden[picked[0]]) in single:
+                picked = [rng.randint(1, colors)]
+            single.add((picked[0], hidden[picked[0]]))
+
+        # The first paint agrees with the hidden assignment.
+        pairs = [(picked[0], hidden[picked[0]])]
+        has_matte = hidden[picked[0]] == 1
+        for color in picked[1:]:
+            finish = 0
+            if not has_matte and rng.random() < matte_density:
+                finish = has_matte = 1
+            pairs.append((color, finish))
+        rng.shuffle(pairs)
+        demands.append([size] + [i for pair in pairs for i in pair])
+
+    rng.shuffle(demands)
+    return {"colors": colors, "customers": len(demands), "demands": demands}
+
+
+def generate_problems(seed, cases, colors, customers, paints, matte_density=0.1, unsatisfiable=0.0):
+    rng = random.Random(seed)
+    for _ in range(cases):
+        yield generate_problem(rng, colors, customers, paints, matte_density,
+                               satisfiable=rng.random() >= unsatisfiable)
+
+
+def write_cases(problems, out):
+    # Code Jam style input, as read by batch_test.py.
+    problems = list(problems)
+    out.write("%d\n" % len(problems))
+    for problem in problems:
+        out.write("%d\n%d\n" % (problem["colors"], problem["customers"]))
+        for customer in problem["demands"]:
+            out.write(" ".join(map(str, customer)) + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('--cases', type=int, default=10, help='the number of problems')
+    parser.add_argument('--colors', type=int, default=100, help='N, the number of colors')
+    parser.add_argument('--customers', type=int, default=100, help='M, the number of customers')
+    parser.add_argument('--paints', type=int, default=200, help='the sum of T per problem')
+    parser.add_argument('--matte-density', type=float, default=0.1, help='the share of matte colors')
+    parser.add_argument('--unsatisfiable', type=float, default=0.0,
+                        help='the fraction of problems with no solution')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_cases(generate_problems(args.seed, args.cases, args.colors, args.customers, args.paints,
+                                  args.matte_density, args.unsatisfiable), sys.stdout)
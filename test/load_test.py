@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#usage: ./load_test.py [input.txt | --generate 1000] [--concurrency 16 | --rate 200] [--duration 30] [--monitor 0.0.0.0:8081]
+"""
+Load test the HTTP service. Problems, read from a Code Jam style input file
+as batch_test.py reads them or made by generate.py, are POSTed to `/v1/`
+(or, with --batch-size, to `/v2/batch` in groups) over and over for the
+duration of the test.
+
+With --concurrency N, N clients each send a request as soon as their last
+one is answered. With --rate R, requests are sent R times a second whether
+or not earlier ones have been answered, and latency is measured from when
+each request was due, so a service that falls behind isn't flattered by
+sending it less.
+
+Throughput, latency percentiles and the error rate are reported, along with
+how much each counter on the monitoring port moved during the test if
+--monitor is given.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, base_dir)
+
+from batch_test import parse_cases
+from generate import generate_problems
+
+# The answers given in place of a result when a solve fails.
+ERROR_CODES = (b"ERROR", b"TIMEOUT", b"OVERLOADED", b"TOO_LARGE")
+
+
+def read_problems(input_file):
+    with open(input_file) as f:
+        content = [x.strip() for x in f.readlines()]
+    return [{"colors": colors, "customers": customers, "demands": demands}
+            for colors, customers, demands in parse_cases(content)]
+
+
+def request_bodies(problems, batch_size):
+    """
+    :param problems: A list of problems.
+    :param batch_size: Problems per /v2/batch request, or 0 for /v1/.
+    :return: A list of (path, content type, body) requests.
+    """
+    encode = lambda problem: json.dumps(problem, separators=(',', ':'))
+    if not batch_size:
+        return [("/v1/", "application/json", encode(problem).encode('utf-8')) for problem in problems]
+    return [("/v2/batch", "application/x-ndjson",
+             ''.join(encode(problem) + '\n' for problem in problems[i:i + batch_size]).encode('utf-8'))
+            for i in range(0, len(problems), batch_size)]
+
+
+async def fetch(host, port, method, path, content_type=None, body=b''):
+    """
+    Make one HTTP/1.1 request on a new connection.
+
+    :return: The status code and the body.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = "%s %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: close\r\nContent-Length: %d\r\n" % (
+            method, path, host, port, len(body))
+        if content_type:
+            head += "Content-Type: %s\r\n" % content_type
+        writer.write(head.encode('ascii') + b"\r\n" + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    return status, content
+
+
+class Recorder:
+    """
+    The outcome of every request. A request fails if it gets no response, an
+    error status, or any error code in place of a result; errors counts the
+    causes, one per failed problem in a batch.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+
+    def error(self, cause):
+        self.errors[cause] = self.errors.get(cause, 0) + 1
+
+    async def send(self, host, port, request, due):
+        path, content_type, body = request
+        self.sent += 1
+        try:
+            status, content = await fetch(host, port, "POST", path, content_type, body)
+        except (OSError, ValueError, IndexError) as e:
+            self.failed += 1
+            self.error(type(e).__name__)
+            return
+        self.latencies.append(time.perf_counter() - due)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        # /v1/ answers with the result, and /v2/batch with "Case #n: result" lines.
+        codes = [line.rsplit(b" ", 1)[-1] for line in content.splitlines()]
+        codes = [code.decode('ascii') for code in codes if code in ERROR_CODES]
+        for code in codes:
+            self.error(code)
+        if status >= 400 and not codes:
+            self.error("HTTP %d" % status)
+        self.failed += status >= 400 or bool(codes)
+
+
+async def closed_loop(host, port, requests, concurrency, duration, recorder):
+    end = time.perf_counter() + duration
+    counter = iter(range(sys.maxsize))
+
+    async def client():
+        while time.perf_counter() < end:
+            request = requests[next(counter) % len(requests)]
+            await recorder.send(host, port, request, time.perf_counter())
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+
+
+async def open_loop(host, port, requests, rate, duration, poisson, recorder, seed):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    due = start
+    tasks = []
+    i = 0
+    while due < start + duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(recorder.send(host, port, requests[i % len(requests)], due)))
+        i += 1
+        due += rng.expovariate(rate) if poisson else 1.0 / rate
+    await asyncio.gather(*tasks)
+
+
+async def scrape(monitor):
+    """
+    :param monitor: The host:port of the monitoring port.
+    :return: {sample: value} for the service's counters, sums and counts.
+    """
+    host, port = monitor.rsplit(":", 1)
+    _, content = await fetch(host, int(port), "GET", "/metrics")
+    samples = {}
+    for line in content.decode('utf-8').splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        name, _, value = line.rpartition(" ")
+        metric = name.split("{")[0]
+        # The client library's own process and GC metrics aren't of interest.
+        if metric.endswith(("_total", "_sum", "_count")) and not metric.startswith(("python_", "process_")):
+            samples[name] = float(value)
+    return samples
+
+
+def report(recorder, elapsed, before, after):
+    latencies = np.array(recorder.latencies) * 1000
+    completed = len(latencies)
+    summary = {
+        "requests": recorder.sent,
+        "completed": completed,
+        "seconds": elapsed,
+        "throughput": completed / elapsed,
+        "error_rate": recorder.failed / max(1, recorder.sent),
+        "statuses": {str(status): n for status, n in sorted(recorder.statuses.items())},
+        "errors": recorder.errors,
+    }
+    if completed:
+        summary["latency_ms"] = {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        }
+    if before is not None and after is not None:
+        summary["monitor"] = {name: after[name] - before.get(name, 0.0) for name in sorted(after)
+                              if after[name] != before.get(name, 0.0)}
+    return summary
+
+
+def print_summary(summary):
+    print("%d requests, %d completed in %.1fs: %.1f per second" % (
+        summary["requests"], summary["completed"], summary["seconds"], summary["throughput"]))
+    if "latency_ms" in summary:
+        print("latency ms  p50 %(p50).2f  p95 %(p95).2f  p99 %(p99).2f  max %(max).2f" % summary["latency_ms"])
+    print("statuses %s" % " ".join("%s:%d" % item for item in summary["statuses"].items()))
+    print("error rate %.2f%% %s" % (100 * summary["error_rate"], json.dumps(summary["errors"], sort_keys=True)))
+    for name, delta in summary.get("monitor", {}).items():
+        print("%-70s %+g" % (name, delta))
+
+
+async def run(args, requests):
+    host, port = args.url.rsplit(":", 1)
+    before = await scrape(args.monitor) if args.monitor else None
+    recorder = Recorder()
+    start = time.perf_counter()
+    if args.rate:
+        await open_loop(host, int(port), requests, args.rate, args.duration, args.poisson, recorder, args.seed)
+    else:
+        await closed_loop(host, int(port), requests, args.concurrency, args.duration, recorder)
+    elapsed = time.perf_counter() - start
+    after = await scrape(args.monitor) if args.monitor else None
+    return report(recorder, elapsed, before, after)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', type=str, nargs='?', default=None, help='a Code Jam style input file of problems')
+    parser.add_argument('--generate', type=int, default=0, help='the number of problems to generate instead')
+    parser.add_argument('--colors', type=int, default=100, help='N of generated problems')
+    parser.add_argument('--customers', type=int, default=100, help='M of generated problems')
+    parser.add_argument('--paints', type=int, default=200, help='the sum of T of generated problems')
+    parser.add_argument('--unsatisfiable', type=float, default=0.5,
+                        help='the fraction of generated problems with no solution')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    parser.add_argument('--url', type=str, default=os.environ.get('PAINTSHOP_HOST', "0.0.0.0:8080"),
+                        help='the host:port of the service')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='send problems to /v2/batch this many at a time rather than to /v1/')
+    parser.add_argument('--concurrency', type=int, default=8, help='the number of clients in a closed loop')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='send this many requests per second in an open loop, instead of --concurrency')
+    parser.add_argument('--poisson', action='store_true', help='space open loop requests randomly, not evenly')
+    parser.add_argument('--duration', type=float, default=10, help='the number of seconds to run for')
+    parser.add_argument('--monitor', type=str, default=None,
+                        help='the host:port of the monitoring port, to report how its counters moved')
+    parser.add_argument('--output', type=str, default=None, help='where to write the report as JSON')
+    return parser.parse_args()
+
+
+def main(args):
+    if args.generate:
+        problems = list(generate_problems(args.seed, args.generate, args.colors, args.customers, args.paints,
+                                          unsatisfiable=args.unsatisfiable))
+    elif args.input:
+        problems = read_problems(args.input)
+    else:
+        print("Give an input file or --generate N")
+        return 2
+
+    loop = asyncio.new_event_loop()
+    try:
+        summary = loop.run_until_complete(run(args, request_bodies(problems, args.batch_size)))
+    finally:
+        loop.close()
+
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return 1 if summary["error_rate"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))